@@ -0,0 +1,330 @@
+# aggregation.py
+
+# Import Modules
+from typing import Self, Optional, Hashable
+from math import log, ceil, inf
+
+
+class QuantileSketch():
+    """Mergeable streaming quantile sketch with relative accuracy.
+
+    Values are counted in logarithmic buckets, so any quantile is within the
+    relative accuracy of the true value. When there are more buckets than
+    allowed the lowest ones are collapsed, which only costs accuracy at the
+    low end.
+    """
+
+    def __init__(
+            self: Self,
+            relative_accuracy: float = 0.01,
+            max_buckets: int = 2048
+            ) -> None:
+        """Initialize the sketch.
+
+        Args:
+            self (Self): self
+            relative_accuracy (float): Relative accuracy of the quantiles
+            max_buckets (int): Bound on the buckets per sign
+
+        Returns:
+            None:
+        """
+
+        self.relative_accuracy: float = relative_accuracy
+        self._gamma: float = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma: float = log(self._gamma)
+        self._max_buckets: int = max_buckets
+
+        # Buckets for positive and negative values (by magnitude)
+        self._positive: dict[int, int] = {}
+        self._negative: dict[int, int] = {}
+        self._zero: int = 0
+
+        self.count: int = 0
+        self.min: float = inf
+        self.max: float = -inf
+
+    def _bucket(self: Self, value: float) -> int:
+        return ceil(log(value) / self._log_gamma)
+
+    def _value(self: Self, bucket: int) -> float:
+        return 2 * self._gamma**bucket / (self._gamma + 1)
+
+    def _collapse(self: Self, buckets: dict[int, int]) -> None:
+        keys = sorted(buckets)
+        while len(keys) > self._max_buckets:
+            lowest = keys.pop(0)
+            buckets[keys[0]] += buckets.pop(lowest)
+
+    def add(self: Self, value: float, count: int = 1) -> None:
+        """Add a value to the sketch.
+
+        Args:
+            self (Self): self
+            value (float): The value
+            count (int): How many times to add it
+
+        Returns:
+            None:
+        """
+
+        if value > 0:
+            bucket = self._bucket(value)
+            self._positive[bucket] = self._positive.get(bucket, 0) + count
+            if len(self._positive) > self._max_buckets:
+                self._collapse(self._positive)
+
+        elif value < 0:
+            bucket = self._bucket(-value)
+            self._negative[bucket] = self._negative.get(bucket, 0) + count
+            if len(self._negative) > self._max_buckets:
+                self._collapse(self._negative)
+
+        else:
+            self._zero += count
+
+        self.count += count
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    def merge(self: Self, other: Self) -> None:
+        """Merge another sketch with the same accuracy into this one.
+
+        Args:
+            self (Self): self
+            other (Self): The sketch to merge
+
+        Returns:
+            None:
+        """
+
+        if other._gamma != self._gamma:
+            raise ValueError("Sketches have different accuracy")
+
+        for bucket, count in other._positive.items():
+            self._positive[bucket] = self._positive.get(bucket, 0) + count
+        for bucket, count in other._negative.items():
+            self._negative[bucket] = self._negative.get(bucket, 0) + count
+        self._collapse(self._positive)
+        self._collapse(self._negative)
+
+        self._zero += other._zero
+        self.count += other.count
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    def quantile(self: Self, q: float) -> Optional[float]:
+        """Get a quantile of the added values.
+
+        Args:
+            self (Self): self
+            q (float): The quantile, between 0 and 1
+
+        Returns:
+            Optional[float]: The quantile, None if the sketch is empty
+        """
+
+        if self.count == 0:
+            return None
+
+        if q <= 0:
+            return self.min
+        if q >= 1:
+            return self.max
+
+        rank = q * (self.count - 1)
+        seen = 0
+
+        # Walk from the most negative to the most positive value
+        for bucket in sorted(self._negative, reverse=True):
+            seen += self._negative[bucket]
+            if seen > rank:
+                return max(-self._value(bucket), self.min)
+
+        seen += self._zero
+        if seen > rank:
+            return 0.0
+
+        for bucket in sorted(self._positive):
+            seen += self._positive[bucket]
+            if seen > rank:
+                return min(self._value(bucket), self.max)
+
+        return self.max
+
+
+class AreaRollup():
+    """Incremental area totals over the telemetry of many houses.
+
+    Every update costs O(1): the totals are corrected with the difference
+    from the previous report of the same house. Besides the totals it keeps
+    sketches of the per house load and temperature, and of the area load
+    sampled at every tick boundary.
+
+    With change-only telemetry a house only reports when it changes, so
+    with a tick step the sketches are fed from the held values of every
+    house once per tick boundary instead of once per report.
+    """
+
+    def __init__(
+            self: Self,
+            device_names: tuple[str, ...] = ('heatpump', 'dryer', 'oven'),
+            relative_accuracy: float = 0.01,
+            tick_step: Optional[int] = None,
+            max_held_ticks: int = 60
+            ) -> None:
+        """Initialize the rollup.
+
+        Args:
+            self (Self): self
+            device_names (tuple[str, ...]): Appliance name of every bit in the device bitmask
+            relative_accuracy (float): Relative accuracy of the sketches
+            tick_step (Optional[int]): Seconds per tick of change-only telemetry, None when every tick is reported
+            max_held_ticks (int): Most tick boundaries filled in at once, longer gaps are clock jumps
+
+        Returns:
+            None:
+        """
+
+        self.device_names: tuple[str, ...] = device_names
+        self.tick_step: Optional[int] = tick_step
+        self._max_held_ticks: int = max_held_ticks
+
+        # Last report per house: (devices, powerusage, temperature)
+        self._houses: dict[Hashable, tuple[int, float, float]] = {}
+
+        self.total_power: float = 0.0
+        self._temperature_sum: float = 0.0
+        self._device_counts: list[int] = [0] * len(device_names)
+
+        self.time: int = 0
+        self.peak_power: float = 0.0
+        self.load: QuantileSketch = QuantileSketch(relative_accuracy)
+        self.temperature: QuantileSketch = QuantileSketch(relative_accuracy)
+        self.area_load: QuantileSketch = QuantileSketch(relative_accuracy)
+
+    def update(
+            self: Self,
+            house_id: Hashable,
+            devices: int,
+            powerusage: float,
+            temperature: float,
+            time: int
+            ) -> None:
+        """Add a telemetry report of a house.
+
+        Args:
+            self (Self): self
+            house_id (Hashable): The house
+            devices (int): Device bitmask
+            powerusage (float): kW draw of the house
+            temperature (float): Temperature of the house
+            time (int): Unix time of the report
+
+        Returns:
+            None:
+        """
+
+        # A newer time means the previous tick is complete
+        if time > self.time:
+            if self._houses:
+                self._sample(time)
+            self.time = time
+
+        last_devices, last_powerusage, last_temperature = \
+                self._houses.get(house_id, (0, 0.0, 0.0))
+        if house_id not in self._houses:
+            self._temperature_sum += temperature
+        else:
+            self._temperature_sum += temperature - last_temperature
+        self._houses[house_id] = (devices, powerusage, temperature)
+
+        self.total_power += powerusage - last_powerusage
+
+        changed = devices ^ last_devices
+        for i in range(len(self._device_counts)):
+            if changed & (1 << i):
+                self._device_counts[i] += 1 if devices & (1 << i) else -1
+
+        if self.tick_step is None:
+            self.load.add(powerusage)
+            self.temperature.add(temperature)
+
+    def _sample(self: Self, time: int) -> None:
+        """Sample the completed tick boundaries before a newer time.
+
+        Args:
+            self (Self): self
+            time (int): Unix time of the newer report
+
+        Returns:
+            None:
+        """
+
+        # Only complete ticks count for the peak, like for the area load
+        self.peak_power = max(self.peak_power, self.total_power)
+
+        if self.tick_step is None:
+            self.area_load.add(self.total_power)
+            return
+
+        # Unchanged houses held their values over the skipped boundaries
+        ticks = (time - self.time) // self.tick_step
+        ticks = ticks if 1 <= ticks <= self._max_held_ticks else 1
+
+        self.area_load.add(self.total_power, ticks)
+        for _, powerusage, temperature in self._houses.values():
+            self.load.add(powerusage, ticks)
+            self.temperature.add(temperature, ticks)
+
+    @property
+    def houses(self: Self) -> int:
+        """Number of houses that have reported."""
+
+        return len(self._houses)
+
+    @property
+    def mean_temperature(self: Self) -> Optional[float]:
+        """Mean of the latest temperature of every house."""
+
+        if not self._houses:
+            return None
+
+        return self._temperature_sum / len(self._houses)
+
+    @property
+    def device_counts(self: Self) -> dict[str, int]:
+        """Number of houses with each appliance currently on."""
+
+        return dict(zip(self.device_names, self._device_counts))
+
+    def merge(self: Self, other: Self) -> None:
+        """Merge the rollup of a disjoint set of houses into this one.
+
+        The totals, device counts and per house sketches merge. The area
+        load sketch and peak do not: they hold the totals of one subset
+        per tick, and the quantiles of the sum are not a function of the
+        quantiles of the parts. Both restart empty and from then on sample
+        the merged area.
+
+        Args:
+            self (Self): self
+            other (Self): The rollup to merge
+
+        Returns:
+            None:
+        """
+
+        self._houses.update(other._houses)
+        self.total_power += other.total_power
+        self._temperature_sum += other._temperature_sum
+        self._device_counts = [
+                a + b for a, b in zip(self._device_counts, other._device_counts)
+                ]
+
+        self.time = max(self.time, other.time)
+        self.load.merge(other.load)
+        self.temperature.merge(other.temperature)
+
+        self.peak_power = 0.0
+        self.area_load = QuantileSketch(self.area_load.relative_accuracy)
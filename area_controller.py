@@ -0,0 +1,658 @@
+# area_controller.py
+
+# Import Modules
+from typing import Optional, NamedTuple
+import socket
+import json
+import argparse
+from threading import Thread, Event, Lock
+from time import sleep, perf_counter
+
+import numpy as np
+
+# Own modules
+from communication_utils import controlpacket_packetinator, decompile_datapacket, \
+        datatrans_packetinator, decompile_packet, signal_packetinator, param_oracle, \
+        decompile_batch_datapacket, DATAPACKET_SIZE, DeltaTelemetryEncoder, \
+        DeltaTelemetryDecoder, decompile_batch_delta, KEYFRAME, DELTA, DELTA_BATCH
+from house_utils import build_house, devices_bitmask, apply_controlpacket, ParamQueue, \
+        PARAM_RANGES
+from aggregation import AreaRollup
+from flexibility_index import FlexibilityIndex, Flexibility
+from models import House
+
+
+# GLOBAL VARS
+SIGNALPORT: int = 6969
+CONTROLPROTOCOLPORT: int = 42069
+DATAPORT: int = 42070
+
+
+class HouseTarget(NamedTuple):
+    """Where to reach a house controller."""
+
+    ip: str
+    signal_port: int = SIGNALPORT
+    control_port: int = CONTROLPROTOCOLPORT
+    # Source port of the telemetry, None to match on the ip only
+    data_port: Optional[int] = None
+    # House id in batched telemetry and before control packets (see supervisor.py)
+    house_id: Optional[int] = None
+
+
+class LoopbackHouseController():
+    """House controller speaking the same protocol as main.py on loopback.
+
+    Every instance binds its own ephemeral ports, so any number of them can
+    run on one machine next to the area controller stand-in.
+    """
+
+    def __init__(
+            self,
+            house: House,
+            data_target: tuple[str, int],
+            tick_interval: float = 1.0,
+            time_step: int = 60,
+            delta: bool = False
+            ) -> None:
+        """Initialize the loopback house controller.
+
+        Args:
+            house (House): The house to run
+            data_target (tuple[str, int]): Where to send the telemetry
+            tick_interval (float): Real seconds between ticks
+            time_step (int): Simulated seconds per tick
+            delta (bool): Send change-only telemetry
+
+        Returns:
+            None:
+        """
+
+        self.house: House = house
+        self._data_target: tuple[str, int] = data_target
+        self._tick_interval: float = tick_interval
+        self._time_step: int = time_step
+        self._stop: Event = Event()
+        self._started: Event = Event()
+        self._params: ParamQueue = ParamQueue()
+
+        self._signalsock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._signalsock.bind(('127.0.0.1', 0))
+        self._signalsock.settimeout(0.1)
+
+        self._controlsock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._controlsock.bind(('127.0.0.1', 0))
+        self._controlsock.listen(128)
+        self._controlsock.settimeout(0.1)
+
+        self._datasock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._datasock.bind(('127.0.0.1', 0))
+        self._datasock.setblocking(False)
+        self._encoder: Optional[DeltaTelemetryEncoder] = DeltaTelemetryEncoder() if delta else None
+
+        self._threads: list[Thread] = [
+                Thread(target=self._signal_listener, daemon=True),
+                Thread(target=self._house_runner, daemon=True),
+                Thread(target=self._command_listener, daemon=True)
+                ]
+
+    @property
+    def target(self) -> HouseTarget:
+        """The address the area controller should use for this house."""
+
+        return HouseTarget(
+                '127.0.0.1',
+                self._signalsock.getsockname()[1],
+                self._controlsock.getsockname()[1],
+                self._datasock.getsockname()[1]
+                )
+
+    def start(self) -> None:
+        """Start the controller threads, ticking begins on the start signal."""
+
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self) -> None:
+        """Stop the controller threads and close the sockets."""
+
+        self._stop.set()
+        for thread in self._threads:
+            thread.join()
+
+        self._signalsock.close()
+        self._controlsock.close()
+        self._datasock.close()
+
+    def _signal_listener(self) -> None:
+        while not self._stop.is_set():
+            try:
+                d, _ = self._signalsock.recvfrom(128)
+            except socket.timeout:
+                continue
+
+            if d[0] > 0:
+                self._started.set()
+            elif self._started.is_set():
+                self._stop.set()
+
+    def _house_runner(self) -> None:
+        while not self._started.is_set():
+            if self._stop.wait(0.01):
+                return
+
+        while not self._stop.wait(self._tick_interval):
+            self._params.apply(self.house)
+            self.house.update_time(self._time_step)
+            devicelist, powerusage, temperature, time = self.house.tick()
+
+            if self._encoder is None:
+                packet = datatrans_packetinator(
+                        devices_bitmask(devicelist),
+                        powerusage,
+                        temperature,
+                        time
+                        )
+            else:
+                # The acknowledgements arrive on the data socket
+                while True:
+                    try:
+                        self._encoder.acknowledge(self._datasock.recv(16))
+                    except BlockingIOError:
+                        break
+
+                packet = self._encoder.encode(
+                        devices_bitmask(devicelist),
+                        powerusage,
+                        temperature,
+                        time
+                        )
+
+            if packet is not None:
+                self._datasock.sendto(packet, self._data_target)
+
+    def _command_listener(self) -> None:
+        while not self._stop.is_set():
+            try:
+                csock, _ = self._controlsock.accept()
+            except socket.timeout:
+                continue
+
+            packet = csock.recv(1024)
+            csock.close()
+
+            try:
+                apply_controlpacket(self.house, decompile_packet(packet), self._params)
+            except Exception as e:
+                print(e)
+
+
+class AreaController():
+    """Local stand-in for the area controller.
+
+    Sends the start/stop signals and control packets to a set of house
+    controllers and consumes their telemetry, measuring the latency from a
+    command until its effect is visible in the telemetry.
+    """
+
+    def __init__(
+            self,
+            targets: list[HouseTarget],
+            data_address: tuple[str, int] = ('', DATAPORT),
+            tick_step: Optional[int] = None
+            ) -> None:
+        """Initialize the area controller.
+
+        Args:
+            targets (list[HouseTarget]): The house controllers to drive
+            data_address (tuple[str, int]): Address to receive telemetry on
+            tick_step (Optional[int]): Simulated seconds per tick when the houses send change-only telemetry
+
+        Returns:
+            None:
+        """
+
+        self.targets: list[HouseTarget] = []
+
+        # Map telemetry sources and batched house ids to the house index
+        self._sources: dict = {}
+        self._house_ids: dict = {}
+
+        self._signalsock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+        self.datasock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.datasock.bind(data_address)
+        self.datasock.settimeout(0.1)
+
+        # Latest telemetry per house (devices, powerusage, temperature, time)
+        self.telemetry: list[Optional[tuple[int, float, float, int]]] = []
+        self.telemetry_count: int = 0
+        self.telemetry_bytes: int = 0
+        self.rollup: AreaRollup = AreaRollup(tick_step=tick_step)
+        self._delta: DeltaTelemetryDecoder = DeltaTelemetryDecoder()
+
+        # Outstanding probes per house: (kind, expected value, send time)
+        self._probes: list[list[tuple[str, int, float]]] = []
+        self.latencies: dict[str, list[float]] = {'clk': [], 'lock': []}
+
+        self._lock: Lock = Lock()
+        self._stop: Event = Event()
+        self._receiver: Thread = Thread(target=self._receive_telemetry, daemon=True)
+
+        for target in targets:
+            self.add_target(target)
+
+    def add_target(self, target: HouseTarget) -> int:
+        """Add a house controller to drive.
+
+        Args:
+            target (HouseTarget): The house controller
+
+        Returns:
+            int: Index of the house
+        """
+
+        with self._lock:
+            if target.house_id is not None:
+                self._house_ids[(target.ip, target.house_id)] = len(self.targets)
+            else:
+                self._sources[(target.ip, target.data_port)] = len(self.targets)
+            self.targets.append(target)
+            self.telemetry.append(None)
+            self._probes.append([])
+
+        return len(self.targets) - 1
+
+    @property
+    def data_address(self) -> tuple[str, int]:
+        """The address telemetry is received on."""
+
+        return self.datasock.getsockname()
+
+    def start(self) -> None:
+        """Start consuming telemetry and send the start signal."""
+
+        self._receiver.start()
+        self.signal(True)
+
+    def stop(self) -> None:
+        """Send the stop signal and stop consuming telemetry."""
+
+        self.signal(False)
+        self._stop.set()
+        self._receiver.join()
+        self._signalsock.close()
+        self.datasock.close()
+
+    def signal(self, start: bool) -> None:
+        """Send the start or stop signal to every house.
+
+        Args:
+            start (bool): Start (True) or stop (False)
+
+        Returns:
+            None:
+        """
+
+        packet = signal_packetinator(start)
+        for address in {(target.ip, target.signal_port) for target in self.targets}:
+            self._signalsock.sendto(packet, address)
+
+    def send_control(self, index: int, packet: bytes) -> None:
+        """Send a control packet to a house.
+
+        Args:
+            index (int): Index of the house in the targets
+            packet (bytes): The control packet
+
+        Returns:
+            None:
+        """
+
+        target = self.targets[index]
+
+        # A supervisor routes on the house id in front of the packet
+        if target.house_id is not None:
+            packet = target.house_id.to_bytes(4, 'big') + packet
+
+        with socket.create_connection((target.ip, target.control_port)) as csock:
+            csock.sendall(packet)
+
+    def send_clk(self, index: int, clk: int) -> None:
+        """Send a clock sync and probe until it shows up in the telemetry.
+
+        Args:
+            index (int): Index of the house in the targets
+            clk (int): The clock to sync to
+
+        Returns:
+            None:
+        """
+
+        with self._lock:
+            self._probes[index].append(('clk', clk, perf_counter()))
+        self.send_control(index, controlpacket_packetinator(clk=clk))
+
+    def send_lock(self, index: int, lock: bool) -> None:
+        """Send a device lock, and probe until the heatpump bit clears.
+
+        Only locking a running heatpump has a visible effect, so that is
+        the only case that is probed.
+
+        Args:
+            index (int): Index of the house in the targets
+            lock (bool): Lock or unlock
+
+        Returns:
+            None:
+        """
+
+        with self._lock:
+            last = self.telemetry[index]
+            if lock and last is not None and last[0] & 1 > 0:
+                self._probes[index].append(('lock', 0, perf_counter()))
+        self.send_control(index, controlpacket_packetinator(lock=lock))
+
+    def shed(
+            self,
+            kw: float,
+            flexibility: FlexibilityIndex,
+            max_houses: Optional[int] = None,
+            min_margin: float = 0.0
+            ) -> list[Flexibility]:
+        """Lock the heatpumps with the most temperature margin to shed a load.
+
+        Args:
+            kw (float): Load to shed
+            flexibility (FlexibilityIndex): Index keyed by the index of the house in the targets
+            max_houses (Optional[int]): Most houses to lock
+            min_margin (float): Least margin above the target temperature
+
+        Returns:
+            list[Flexibility]: The locked houses
+        """
+
+        chosen = flexibility.query(kw, max_houses, min_margin)
+        for house in chosen:
+            flexibility.discard(house.key)
+            self.send_lock(house.key, True)
+
+        return chosen
+
+    def _receive_telemetry(self) -> None:
+        while not self._stop.is_set():
+            try:
+                packet, source = self.datasock.recvfrom(65536)
+            except socket.timeout:
+                continue
+
+            received = perf_counter()
+            self.telemetry_bytes += len(packet)
+
+            # Change-only telemetry, keyframes are acknowledged to the sender
+            if packet[0] in (KEYFRAME, DELTA):
+                index = self._sources.get(source, self._sources.get((source[0], None)))
+                telemetry, ack = self._delta.decode(packet, source)
+                if ack is not None:
+                    self.datasock.sendto(ack, source)
+                if index is not None and telemetry is not None:
+                    self._handle_telemetry(index, received, *telemetry)
+                continue
+
+            if packet[0] == DELTA_BATCH:
+                for house_id, record in decompile_batch_delta(packet):
+                    index = self._house_ids.get((source[0], house_id))
+                    telemetry, _ = self._delta.decode(record, (source[0], house_id))
+                    if index is not None and telemetry is not None:
+                        self._handle_telemetry(index, received, *telemetry)
+                continue
+
+            if len(packet) == DATAPACKET_SIZE:
+                index = self._sources.get(source, self._sources.get((source[0], None)))
+                if index is not None:
+                    self._handle_telemetry(index, received, *decompile_datapacket(packet))
+                continue
+
+            for house_id, *telemetry in decompile_batch_datapacket(packet):
+                index = self._house_ids.get((source[0], house_id))
+                if index is not None:
+                    self._handle_telemetry(index, received, *telemetry)
+
+    def _handle_telemetry(
+            self,
+            index: int,
+            received: float,
+            devices: int,
+            powerusage: float,
+            temperature: float,
+            time: int
+            ) -> None:
+        with self._lock:
+            self.telemetry[index] = (devices, powerusage, temperature, time)
+            self.telemetry_count += 1
+            self.rollup.update(index, devices, powerusage, temperature, time)
+
+            # Resolve the probes that are now visible
+            pending = []
+            for kind, expected, sent in self._probes[index]:
+                if (kind == 'clk' and time >= expected) or \
+                        (kind == 'lock' and devices & 1 == expected):
+                    self.latencies[kind].append(received - sent)
+                else:
+                    pending.append((kind, expected, sent))
+            self._probes[index] = pending
+
+    def run_load(
+            self,
+            duration: float,
+            clk_rate: float = 0.0,
+            lock_rate: float = 0.0,
+            param_rate: float = 0.0,
+            clk_jump: int = 3600,
+            seed: Optional[int] = None
+            ) -> dict:
+        """Fire control packets at the houses and report latency and throughput.
+
+        Args:
+            duration (float): Seconds to run the load for
+            clk_rate (float): Clock sync packets per second (whole area)
+            lock_rate (float): Device lock packets per second (whole area)
+            param_rate (float): Parameter packets per second (whole area)
+            clk_jump (int): Seconds to move a house clock forward per sync
+            seed (Optional[int]): Seed for picking houses and values
+
+        Returns:
+            dict: The report, see format_report
+        """
+
+        if not self.targets:
+            raise ValueError("No house controllers to send the load to")
+
+        rng = np.random.default_rng(seed)
+        rates = {'clk': clk_rate, 'lock': lock_rate, 'param': param_rate}
+        sent = {kind: 0 for kind in rates}
+        telemetry_start = self.telemetry_count
+        bytes_start = self.telemetry_bytes
+
+        start = perf_counter()
+        next_send = {kind: start for kind, rate in rates.items() if rate > 0}
+
+        while next_send:
+            kind = min(next_send, key=next_send.get)
+            if next_send[kind] - start >= duration:
+                break
+
+            delay = next_send[kind] - perf_counter()
+            if delay > 0:
+                sleep(delay)
+
+            index = int(rng.integers(len(self.targets)))
+            last = self.telemetry[index]
+
+            match kind:
+
+                case 'clk':
+                    clk = (last[3] if last is not None else 0) + clk_jump
+                    self.send_clk(index, clk)
+
+                case 'lock':
+                    self.send_lock(index, bool(rng.integers(2)))
+
+                case 'param':
+                    paramname = str(rng.choice(list(param_oracle)))
+                    paramtype = param_oracle[paramname]['type']
+
+                    # Real settings stay in range, placeholders take anything
+                    if paramname in PARAM_RANGES:
+                        low, high = PARAM_RANGES[paramname]
+                        value = int(rng.integers(low, high + 1)) if paramtype == 'int' \
+                                else float(rng.uniform(low, high))
+                    else:
+                        value = {
+                                'int': int(rng.integers(256)),
+                                'bool': bool(rng.integers(2)),
+                                'float': float(rng.uniform())
+                                }[paramtype]
+                    self.send_control(
+                            index,
+                            controlpacket_packetinator(params={paramname: value})
+                            )
+
+            sent[kind] += 1
+            next_send[kind] += 1 / rates[kind]
+
+        elapsed = perf_counter() - start
+
+        with self._lock:
+            unresolved = sum(len(probes) for probes in self._probes)
+            latencies = {kind: list(values) for kind, values in self.latencies.items()}
+
+        return {
+                'elapsed': elapsed,
+                'sent': sent,
+                'control_rate': sum(sent.values()) / elapsed,
+                'telemetry_rate': (self.telemetry_count - telemetry_start) / elapsed,
+                'change_only': self.rollup.tick_step is not None,
+                'telemetry_bandwidth': (self.telemetry_bytes - bytes_start) / elapsed,
+                'latencies': latencies,
+                'unresolved': unresolved,
+                'area_load': (
+                    self.rollup.peak_power,
+                    self.rollup.area_load.quantile(0.5),
+                    self.rollup.area_load.quantile(0.95)
+                    )
+                }
+
+
+def format_report(report: dict) -> str:
+    """Format a load report as text.
+
+    Args:
+        report (dict): Output of AreaController.run_load
+
+    Returns:
+        str: Human readable report
+    """
+
+    lines = [
+            f"elapsed: {report['elapsed']:.2f} s",
+            f"sent: {report['sent']}",
+            f"control throughput: {report['control_rate']:.1f} packets/s",
+            f"telemetry throughput: {report['telemetry_rate']:.1f} "
+            f"{'change-only records' if report['change_only'] else 'reports'}/s, "
+            f"{report['telemetry_bandwidth']:.0f} bytes/s",
+            f"unresolved probes: {report['unresolved']}"
+            ]
+
+    peak, p50, p95 = report['area_load']
+    if p50 is not None:
+        lines.append(f"area load: p50 {p50:.2f} kW, p95 {p95:.2f} kW, peak {peak:.2f} kW")
+
+    for kind, values in report['latencies'].items():
+        if not values:
+            lines.append(f"{kind} latency: no samples")
+            continue
+
+        p50, p95, p99 = np.percentile(values, [50, 95, 99]) * 1000
+        lines.append(
+                f"{kind} latency ({len(values)} samples): "
+                f"p50 {p50:.2f} ms, p95 {p95:.2f} ms, p99 {p99:.2f} ms, "
+                f"max {max(values)*1000:.2f} ms"
+                )
+
+    return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Local area controller stand-in and load generator")
+    parser.add_argument('--houses', type=int, default=0, help="Loopback house controllers to run")
+    parser.add_argument('--target', action='append', default=[], help="IP of a real house controller")
+    parser.add_argument('--sharded', type=int, default=0, help="Houses run by supervisor.py on this machine")
+    parser.add_argument('--control-port', type=int, default=CONTROLPROTOCOLPORT, help="Control port of the supervisor")
+    parser.add_argument('--duration', type=float, default=10.0)
+    parser.add_argument('--tick-interval', type=float, default=1.0, help="Real seconds per tick of the loopback houses")
+    parser.add_argument('--clk-rate', type=float, default=1.0)
+    parser.add_argument('--lock-rate', type=float, default=1.0)
+    parser.add_argument('--param-rate', type=float, default=0.0)
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--delta', action='store_true', help="Houses send change-only telemetry (start supervisor.py with --delta too)")
+    parser.add_argument('--shed', type=float, default=0.0, help="kW to shed from the loopback houses at the end")
+    args = parser.parse_args()
+
+    if not (args.houses or args.target or args.sharded):
+        parser.error("no houses, give --houses, --target or --sharded")
+
+    with open('coefficients.json', 'r') as fd:
+        coefficients = json.load(fd)
+
+    with open('house_settings.json', 'r') as fd:
+        house_setting = json.load(fd)
+
+    with open('appliance_data.json', 'r') as fd:
+        appliance_data = json.load(fd)
+
+    # Real controllers send their telemetry to the fixed data port,
+    # loopback controllers are told where to send it
+    targets = [HouseTarget(ip) for ip in args.target]
+    targets += [
+            HouseTarget('127.0.0.1', control_port=args.control_port, house_id=i)
+            for i in range(args.sharded)
+            ]
+    area = AreaController(
+            targets,
+            ('', DATAPORT) if targets else ('127.0.0.1', 0),
+            60 if args.delta else None
+            )
+
+    house_nrs = list(house_setting)
+    houses = []
+    for i in range(args.houses):
+        house = build_house(house_setting[house_nrs[i % len(house_nrs)]], appliance_data, coefficients)
+        houses.append(LoopbackHouseController(house, area.data_address, args.tick_interval, delta=args.delta))
+
+    flexibility = FlexibilityIndex()
+    for controller in houses:
+        flexibility.track(area.add_target(controller.target), controller.house)
+        controller.start()
+
+    area.start()
+    report = area.run_load(
+            args.duration,
+            args.clk_rate,
+            args.lock_rate,
+            args.param_rate,
+            seed=args.seed
+            )
+
+    shed = area.shed(args.shed, flexibility) if args.shed > 0 else []
+    area.stop()
+
+    for controller in houses:
+        controller.stop()
+
+    print(format_report(report))
+    if shed:
+        print(
+                f"shed {sum(house.kw for house in shed):.2f} kW by locking houses "
+                + ', '.join(f"{house.key} ({house.margin:+.2f} C)" for house in shed)
+                )
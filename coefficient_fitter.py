@@ -0,0 +1,270 @@
+# coefficient_fitter.py
+
+# Import Modules
+from typing import Self, Iterator
+from itertools import islice
+import argparse
+import json
+import os
+
+import numpy as np
+
+
+class PolynomialFitter():
+    """Least squares polynomial fit over a stream of samples.
+
+    Only the normal equations are kept, so the memory does not depend on
+    the number of samples. The x values are scaled to [0, 1] while
+    accumulating to keep the normal equations well conditioned.
+    """
+
+    def __init__(self: Self, degree: int, scale: float = 24.0) -> None:
+        """Initialize the fitter.
+
+        Args:
+            self (Self): self
+            degree (int): Degree of the polynomial
+            scale (float): Range of the x values
+
+        Returns:
+            None:
+        """
+
+        self.degree: int = degree
+        self._scale: float = scale
+        self._xtx: np.ndarray = np.zeros((degree + 1, degree + 1))
+        self._xty: np.ndarray = np.zeros(degree + 1)
+        self.samples: int = 0
+
+    def add(self: Self, x: np.ndarray, y: np.ndarray) -> None:
+        """Add a chunk of samples.
+
+        Args:
+            self (Self): self
+            x (np.ndarray): x values
+            y (np.ndarray): y values
+
+        Returns:
+            None:
+        """
+
+        vander = np.polynomial.polynomial.polyvander(
+                np.asarray(x, dtype=np.float64) / self._scale,
+                self.degree
+                )
+        self._xtx += vander.T @ vander
+        self._xty += vander.T @ np.asarray(y, dtype=np.float64)
+        self.samples += len(x)
+
+    def coefficients(self: Self) -> list[float]:
+        """Solve the normal equations.
+
+        Args:
+            self (Self): self
+
+        Returns:
+            list[float]: Coefficients in increasing order, as used by polyval
+        """
+
+        scaled, *_ = np.linalg.lstsq(self._xtx, self._xty, rcond=None)
+        return (scaled / self._scale**np.arange(self.degree + 1)).tolist()
+
+
+def iter_csv_chunks(
+        path: str,
+        columns: list[str],
+        chunk_rows: int = 1_000_000
+        ) -> Iterator[np.ndarray]:
+    """Read columns of a CSV file with a header line in chunks.
+
+    Args:
+        path (str): The CSV file
+        columns (list[str]): Names of the columns to read
+        chunk_rows (int): Rows per chunk
+
+    Returns:
+        Iterator[np.ndarray]: Chunks with one column per requested column
+    """
+
+    with open(path, 'r') as fd:
+        header = [name.strip() for name in fd.readline().split(',')]
+        usecols = [header.index(name) for name in columns]
+
+        while True:
+            lines = list(islice(fd, chunk_rows))
+            if not lines:
+                return
+
+            yield np.loadtxt(lines, delimiter=',', usecols=usecols, ndmin=2)
+
+
+def iter_binary_chunks(
+        path: str,
+        columns: int,
+        usecols: list[int],
+        chunk_rows: int = 1_000_000
+        ) -> Iterator[np.ndarray]:
+    """Read columns of a raw float64 file in chunks through a memory map.
+
+    Args:
+        path (str): The file, rows of float64 values
+        columns (int): Values per row
+        usecols (list[int]): Indices of the columns to read
+        chunk_rows (int): Rows per chunk
+
+    Returns:
+        Iterator[np.ndarray]: Chunks with one column per requested column
+    """
+
+    data = np.memmap(path, dtype=np.float64, mode='r')
+    data = data[:len(data) - len(data) % columns].reshape(-1, columns)
+
+    for start in range(0, len(data), chunk_rows):
+        yield np.array(data[start:start+chunk_rows, usecols])
+
+
+def fit_coefficients(
+        chunks: Iterator[np.ndarray],
+        background: bool,
+        states: list[str],
+        degree: int = 10,
+        on_threshold: float = 0.0,
+        allowed_cycles: int = 1
+        ) -> dict[str, list[float]]:
+    """Fit background and appliance coefficients in one pass over the data.
+
+    The chunks hold the unix time, then the background kW if background is
+    set, then the kW (or on/off) of every appliance in states, sampled every
+    tick. The background is fitted as kW over the hour of the day. An
+    appliance is fitted as the chance to start in a tick while it is off
+    and may still start a cycle that (UTC) day, like the appliances only
+    draw a start below their allowed cycles.
+
+    Both polynomials are over the hour of the day. House.tick samples the
+    background that way, but Appliance._calculate_state evaluates the
+    start chance at the hours since the unix epoch, so the fitted chances
+    only match the model on the day starting at time 0.
+
+    Args:
+        chunks (Iterator[np.ndarray]): Chunks of the data
+        background (bool): Fit the background power
+        states (list[str]): Names of the appliances to fit
+        degree (int): Degree of the polynomials
+        on_threshold (float): An appliance above this is on
+        allowed_cycles (int): Cycles an appliance may start per day, 0 and less is infinite
+
+    Returns:
+        dict[str, list[float]]: Coefficients by coefficients.json key
+    """
+
+    fitters: dict[str, PolynomialFitter] = {}
+    if background:
+        fitters['background'] = PolynomialFitter(degree)
+    for name in states:
+        fitters[name] = PolynomialFitter(degree)
+
+    # State of every appliance and its starts that day at the end of the last chunk
+    last_on: np.ndarray = np.zeros(len(states), dtype=bool)
+    last_starts: np.ndarray = np.zeros(len(states), dtype=np.int64)
+    last_day: int = -1
+
+    for chunk in chunks:
+        hours = (chunk[:, 0] % 86400) / 3600
+        days = (chunk[:, 0] // 86400).astype(np.int64)
+        column = 1
+
+        # Segments of ticks on the same day
+        new_day = np.diff(days, prepend=days[0] - 1) != 0
+        first = np.flatnonzero(new_day)
+        segment = np.cumsum(new_day) - 1
+        continued = days == last_day
+
+        if background:
+            fitters['background'].add(hours, chunk[:, column])
+            column += 1
+
+        for i, name in enumerate(states):
+            on = chunk[:, column + i] > on_threshold
+            was_on = np.concatenate(([last_on[i]], on[:-1]))
+            last_on[i] = on[-1]
+
+            # Starts earlier that day, before every tick
+            started = (on & ~was_on).astype(np.int64)
+            before = np.cumsum(started) - started
+            before = before - before[first][segment] + np.where(continued, last_starts[i], 0)
+            last_starts[i] = before[-1] + started[-1]
+
+            # Only ticks where it was off and had cycles left could have started one
+            chance = ~was_on
+            if allowed_cycles > 0:
+                chance &= before < allowed_cycles
+            fitters[name].add(hours[chance], on[chance])
+
+        last_day = int(days[-1])
+
+    return {name: fitter.coefficients() for name, fitter in fitters.items()}
+
+
+def write_coefficients(path: str, coefficients: dict[str, list[float]]) -> None:
+    """Update coefficients.json, keeping the keys that were not fitted.
+
+    Args:
+        path (str): The coefficients file
+        coefficients (dict[str, list[float]]): Coefficients by key
+
+    Returns:
+        None:
+    """
+
+    existing: dict = {}
+    if os.path.exists(path):
+        with open(path, 'r') as fd:
+            existing = json.load(fd)
+
+    existing.update(coefficients)
+
+    # One line per key, like the file in the repo
+    lines = [f'    "{key}": {json.dumps(value)}' for key, value in existing.items()]
+    with open(path, 'w') as fd:
+        fd.write('{\n' + ',\n'.join(lines) + '\n}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Fit coefficients.json from meter data in one streaming pass")
+    parser.add_argument('data', help="CSV with a header, or raw float64 rows with --binary")
+    parser.add_argument('--time-column', default='time')
+    parser.add_argument('--background', default=None, help="Column with the background kW")
+    parser.add_argument('--state', action='append', default=[], help="key=column of an appliance, e.g. oven=oven_kw")
+    parser.add_argument('--binary', default=None, help="Comma separated column names of the binary rows")
+    parser.add_argument('--degree', type=int, default=10)
+    parser.add_argument('--on-threshold', type=float, default=0.0)
+    parser.add_argument('--allowed-cycles', type=int, default=1, help="Cycles per day the appliances may start, 0 for infinite")
+    parser.add_argument('--chunk-rows', type=int, default=1_000_000)
+    parser.add_argument('--output', default='coefficients.json')
+    args = parser.parse_args()
+
+    states = dict(item.split('=', 1) for item in args.state)
+    columns = [args.time_column] + \
+            ([args.background] if args.background else []) + \
+            list(states.values())
+
+    if args.binary:
+        names = args.binary.split(',')
+        chunks = iter_binary_chunks(
+                args.data,
+                len(names),
+                [names.index(name) for name in columns],
+                args.chunk_rows
+                )
+    else:
+        chunks = iter_csv_chunks(args.data, columns, args.chunk_rows)
+
+    coefficients = fit_coefficients(
+            chunks,
+            args.background is not None,
+            list(states),
+            args.degree,
+            args.on_threshold,
+            args.allowed_cycles
+            )
+    write_coefficients(args.output, coefficients)
@@ -1,14 +1,29 @@
 # communication_utils.py
 
 # Import Modules
+from typing import Optional, Union, NamedTuple, Hashable
 import struct
 import json
 import socket
 
+import numpy as np
+
 # Load the param oracle
 with open('param_oracle.json', 'r') as fp:
     param_oracle = json.load(fp)
 
+# Param oracle indexed by id, (name, type)
+param_oracle_by_id: dict[int, tuple[str, str]] = {
+        item['id']: (name, item['type']) for name, item in param_oracle.items()
+        }
+
+# Column dtypes of the decoded param types
+PARAM_DTYPES: dict[str, type] = {
+        'int': np.int64,
+        'bool': np.bool_,
+        'float': np.float64
+        }
+
 def decompile_packet(packet: bytes) -> tuple[int, int, dict, int]:
     """Decompiles the packet and extracts parameters
 
@@ -51,17 +66,8 @@ def decompile_packet(packet: bytes) -> tuple[int, int, dict, int]:
             paramdata = packet[cursor:cursor+paramsize]
             cursor += paramsize
 
-            # Make variables to hold param name and param type
-            paramname = ''
-            paramtype = ''
-
-            # Find the parameter in param oracle
-            # and set the name and type
-            for item in param_oracle.items():
-                if item[1]['id'] == paramid:
-                    paramname = item[0]
-                    paramtype = item[1]['type']
-                    break
+            # Find the name and type in the param oracle
+            paramname, paramtype = param_oracle_by_id.get(paramid, ('', ''))
 
             # Match on the param type and convert the data
             match paramtype:
@@ -85,6 +91,142 @@ def decompile_packet(packet: bytes) -> tuple[int, int, dict, int]:
 
     return (flags, clk, paramdict, devices)
 
+class PacketBatch(NamedTuple):
+    """Columnar result of decompile_packets.
+
+    clk and devices are -1 where the packet does not carry them, params maps
+    a param name to the indices of the packets carrying it and the values.
+    """
+
+    flags: np.ndarray
+    clk: np.ndarray
+    devices: np.ndarray
+    params: dict[str, tuple[np.ndarray, np.ndarray]]
+
+def _param_column(
+        buf: np.ndarray,
+        starts: np.ndarray,
+        sizes: np.ndarray,
+        paramtype: str
+        ) -> np.ndarray:
+    """Convert the data of one param in many packets, like decompile_packet.
+
+    Args:
+        buf (np.ndarray): The packets as bytes
+        starts (np.ndarray): Start of the data in every packet
+        sizes (np.ndarray): Size of the data in every packet
+        paramtype (str): Type of the param in the param oracle
+
+    Returns:
+        np.ndarray: The values, with the dtype of the type in PARAM_DTYPES
+    """
+
+    match paramtype:
+
+        case 'int':
+            # Big endian of any size up to 8 bytes, per size
+            values = np.zeros(len(starts), dtype=np.uint64)
+            for size in np.unique(sizes).tolist():
+                selected = sizes == size
+                data = buf[starts[selected, None] + np.arange(size)].astype(np.uint64)
+                shifts = (8 * np.arange(size - 1, -1, -1)).astype(np.uint64)
+                values[selected] = (data << shifts).sum(axis=1, dtype=np.uint64)
+            return values.astype(np.int64)
+
+        case 'bool':
+            return buf[starts] > 0
+
+        case 'float':
+            if (sizes != 8).any():
+                raise ValueError('Invalid float size')
+            return buf[starts[:, None] + np.arange(8)].view('>f8').ravel().astype(np.float64)
+
+        case _:
+            raise ValueError('Invalid type or id not found')
+
+def decompile_packets(
+        packets: Union[bytes, list[bytes]],
+        offsets: Optional[np.ndarray] = None
+        ) -> PacketBatch:
+    """Decompile many control packets at once.
+
+    The fixed layout fields are gathered for all packets with NumPy. The
+    parameters are decoded a slot at a time for all packets carrying one
+    (the first parameter of every packet, then the second, ...), the
+    values of a slot are converted per param id as one column.
+
+    Args:
+        packets (Union[bytes, list[bytes]]): Concatenated packets, or a list of packets
+        offsets (Optional[np.ndarray]): Start of every packet in the buffer (only for concatenated packets)
+
+    Returns:
+        PacketBatch: Decompiled parameters as columns
+    """
+
+    # Concatenate a list of packets
+    if not isinstance(packets, (bytes, bytearray, memoryview)):
+        offsets = np.zeros(len(packets), dtype=np.int64)
+        np.cumsum(np.fromiter(map(len, packets[:-1]), dtype=np.int64, count=max(len(packets) - 1, 0)), out=offsets[1:])
+        packets = b''.join(packets)
+
+    if offsets is None:
+        raise ValueError('Offsets are needed for concatenated packets')
+
+    buf = np.frombuffer(packets, dtype=np.uint8)
+    offsets = np.asarray(offsets, dtype=np.int64)
+    flags = buf[offsets]
+
+    # Decompile clock sync, 4 big endian bytes after the flags
+    has_clk = flags & 1 > 0
+    clk = np.full(len(offsets), -1, dtype=np.int64)
+    clk_bytes = buf[offsets[has_clk, None] + np.arange(1, 5)].astype(np.int64)
+    clk[has_clk] = (clk_bytes[:, 0] << 24) | (clk_bytes[:, 1] << 16) | \
+            (clk_bytes[:, 2] << 8) | clk_bytes[:, 3]
+
+    # Cursor after the fixed part
+    cursors = offsets + 1 + 4 * has_clk
+
+    # Decompile parameters, one slot of all packets that have it at a time
+    rows = np.flatnonzero(flags & 2 > 0)
+    param_cursors = cursors[rows]
+    paramnums = buf[param_cursors].astype(np.int64)
+    param_cursors += 1
+
+    columns: dict[str, list[tuple[np.ndarray, np.ndarray]]] = {}
+    for slot in range(int(paramnums.max()) if len(rows) else 0):
+        active = paramnums > slot
+        slot_rows = rows[active]
+        paramids = buf[param_cursors[active]]
+        paramsizes = buf[param_cursors[active] + 1].astype(np.int64)
+        starts = param_cursors[active] + 2
+
+        for paramid in np.unique(paramids).tolist():
+            selected = paramids == paramid
+            paramname, paramtype = param_oracle_by_id.get(paramid, ('', ''))
+            columns.setdefault(paramname, []).append((
+                slot_rows[selected],
+                _param_column(buf, starts[selected], paramsizes[selected], paramtype)
+                ))
+
+        param_cursors[active] = starts + paramsizes
+
+    cursors[rows] = param_cursors
+
+    # Keep the packet order, a stable sort keeps the slot order within a packet
+    params = {}
+    for paramname, pieces in columns.items():
+        indices = np.concatenate([indices for indices, _ in pieces])
+        values = np.concatenate([values for _, values in pieces])
+        order = np.argsort(indices, kind='stable')
+        params[paramname] = (indices[order], values[order])
+
+    # Decompile devices
+    has_devices = flags & 8 > 0
+    devices = np.full(len(offsets), -1, dtype=np.int16)
+    devices[has_devices] = buf[cursors[has_devices]]
+
+    return PacketBatch(flags, clk, devices, params)
+
 def datatrans_packetinator(
         devices: int,
         powerusage: float,
@@ -114,8 +256,411 @@ def datatrans_packetinator(
 
     return packet
 
-signal_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-signal_sock.bind(('', 6969))
+def decompile_datapacket(packet: bytes) -> tuple[int, float, float, int]:
+    """Decompile a data packet made by datatrans_packetinator.
+
+    Args:
+        packet (bytes): A data packet
+
+    Returns:
+        tuple[int, float, float, int]: Device status, powerusage, temperature and time
+    """
+
+    devices = packet[0]
+    powerusage, temperature = struct.unpack('>ff', packet[1:9])
+    time = int.from_bytes(packet[9:13], 'big')
+
+    return (devices, powerusage, temperature, time)
+
+# Batched data packets: house count, then house id and data packet per house
+DATAPACKET_SIZE: int = 13
+BATCH_RECORD: struct.Struct = struct.Struct('>IBffI')
+
+def batch_datatrans_packetinator(
+        records: list[tuple[int, int, float, float, int]]
+        ) -> bytes:
+    """Make one data packet for several houses.
+
+    Args:
+        records (list[tuple[int, int, float, float, int]]): House id, devices, powerusage, temperature and time per house
+
+    Returns:
+        bytes: Packet in bytes
+    """
+
+    return len(records).to_bytes(2, 'big') + \
+            b''.join(BATCH_RECORD.pack(*record) for record in records)
+
+def decompile_batch_datapacket(
+        packet: bytes
+        ) -> list[tuple[int, int, float, float, int]]:
+    """Decompile a batched data packet.
+
+    Args:
+        packet (bytes): A packet made by batch_datatrans_packetinator
+
+    Returns:
+        list[tuple[int, int, float, float, int]]: House id, devices, powerusage, temperature and time per house
+    """
+
+    count = int.from_bytes(packet[:2], 'big')
+    return list(BATCH_RECORD.iter_unpack(packet[2:2+count*BATCH_RECORD.size]))
+
+# Change-only telemetry: packets start with a marker byte, which a data
+# packet (devices) or a batched data packet (count) never starts with
+KEYFRAME: int = 0xD0
+DELTA: int = 0xD1
+ACK: int = 0xD2
+DELTA_BATCH: int = 0xD3
+
+# Keyframe: marker, sequence, devices, powerusage, temperature, time
+KEYFRAME_RECORD: struct.Struct = struct.Struct('>BHBffI')
+# Delta: marker, keyframe sequence, field mask, devices, seconds since the keyframe
+DELTA_HEADER: struct.Struct = struct.Struct('>BHBBH')
+DELTA_FIELD: struct.Struct = struct.Struct('>h')
+ACK_RECORD: struct.Struct = struct.Struct('>BH')
+
+# Field mask bits of a delta
+DELTA_POWER: int = 1
+DELTA_TEMPERATURE: int = 2
+
+# Quantization of the deltas, in kW and degrees
+POWER_STEP: float = 0.001
+TEMPERATURE_STEP: float = 0.01
+
+# Keyframes the decoder remembers per house
+KEYFRAME_HISTORY: int = 4
+
+def _float32(value: float) -> float:
+    return struct.unpack('>f', struct.pack('>f', value))[0]
+
+class DeltaTelemetryEncoder():
+    """Change-only telemetry of one house.
+
+    A tick is only reported when the devices change, the kW draw or the
+    temperature moves more than its deadband from what the receiver holds,
+    or the clock jumps. Reports are deltas to the last acknowledged keyframe,
+    quantized to 16 bits, so a lost delta never corrupts later ones. Full
+    keyframes are sent periodically and when a delta does not fit. Without
+    acknowledgements every keyframe is assumed to arrive, and lost packets
+    are repaired by the next keyframe.
+    """
+
+    def __init__(
+            self,
+            keyframe_interval: int = 60,
+            power_deadband: float = 0.05,
+            temperature_deadband: float = 0.05,
+            acknowledged: bool = True
+            ) -> None:
+        """Initialize the encoder.
+
+        Args:
+            keyframe_interval (int): Ticks between keyframes
+            power_deadband (float): kW change that is reported
+            temperature_deadband (float): Temperature change that is reported
+            acknowledged (bool): Wait for acknowledgements before sending deltas
+
+        Returns:
+            None:
+        """
+
+        self._keyframe_interval: int = keyframe_interval
+        self._power_deadband: float = power_deadband
+        self._temperature_deadband: float = temperature_deadband
+        self._acknowledged: bool = acknowledged
+
+        self._sequence: int = 0
+        self._since_keyframe: int = 0
+
+        # Keyframes by sequence: (devices, powerusage, temperature, time)
+        self._pending: dict[int, tuple[int, float, float, int]] = {}
+        self._keyframe: Optional[tuple[int, tuple[int, float, float, int]]] = None
+
+        # What the receiver holds, and the time and step of the last tick
+        self._reported: Optional[tuple[int, float, float]] = None
+        self._time: Optional[int] = None
+        self._step: Optional[int] = None
+
+    def acknowledge(self, packet: bytes) -> None:
+        """Handle an acknowledgement from the decoder.
+
+        Args:
+            packet (bytes): The acknowledgement
+
+        Returns:
+            None:
+        """
+
+        marker, sequence = ACK_RECORD.unpack_from(packet)
+        if marker != ACK or sequence not in self._pending:
+            return
+
+        self._keyframe = (sequence, self._pending[sequence])
+
+        # Older keyframes in flight are not needed anymore
+        self._pending = {
+                pending: values for pending, values in self._pending.items()
+                if (pending - sequence) % 65536 < 32768
+                }
+
+    def _make_keyframe(
+            self,
+            devices: int,
+            powerusage: float,
+            temperature: float,
+            time: int
+            ) -> bytes:
+        self._sequence = (self._sequence + 1) % 65536
+        self._since_keyframe = 0
+
+        values = (devices, _float32(powerusage), _float32(temperature), time)
+        if self._acknowledged:
+            self._pending[self._sequence] = values
+            if len(self._pending) > KEYFRAME_HISTORY:
+                del self._pending[next(iter(self._pending))]
+        else:
+            self._keyframe = (self._sequence, values)
+
+        self._reported = values[:3]
+        return KEYFRAME_RECORD.pack(KEYFRAME, self._sequence, *values)
+
+    def encode(
+            self,
+            devices: int,
+            powerusage: float,
+            temperature: float,
+            time: int
+            ) -> Optional[bytes]:
+        """Encode the result of a tick.
+
+        Args:
+            devices (int): Device status
+            powerusage (float): Powerusage
+            temperature (float): Temperature
+            time (int): Time
+
+        Returns:
+            Optional[bytes]: Packet to send, None if nothing needs reporting
+        """
+
+        self._since_keyframe += 1
+
+        # A clock set shows as a different step between ticks
+        step = None if self._time is None else time - self._time
+        jumped = self._step is not None and step != self._step
+        self._time, self._step = time, step
+
+        if self._reported is None or self._keyframe is None or \
+                self._since_keyframe >= self._keyframe_interval:
+            return self._make_keyframe(devices, powerusage, temperature, time)
+
+        reported_devices, reported_power, reported_temperature = self._reported
+        mask = 0
+        if abs(powerusage - reported_power) >= self._power_deadband:
+            mask |= DELTA_POWER
+        if abs(temperature - reported_temperature) >= self._temperature_deadband:
+            mask |= DELTA_TEMPERATURE
+
+        if mask == 0 and devices == reported_devices and not jumped:
+            return None
+
+        sequence, (_, key_power, key_temperature, key_time) = self._keyframe
+        seconds = time - key_time
+        power_delta = round((powerusage - key_power) / POWER_STEP)
+        temperature_delta = round((temperature - key_temperature) / TEMPERATURE_STEP)
+
+        # Send a keyframe when the delta does not fit
+        if not 0 <= seconds < 65536 or \
+                not -32768 <= power_delta < 32768 or \
+                not -32768 <= temperature_delta < 32768:
+            return self._make_keyframe(devices, powerusage, temperature, time)
+
+        packet = DELTA_HEADER.pack(DELTA, sequence, mask, devices, seconds)
+        if mask & DELTA_POWER:
+            packet += DELTA_FIELD.pack(power_delta)
+            reported_power = key_power + power_delta * POWER_STEP
+        if mask & DELTA_TEMPERATURE:
+            packet += DELTA_FIELD.pack(temperature_delta)
+            reported_temperature = key_temperature + temperature_delta * TEMPERATURE_STEP
+
+        self._reported = (devices, reported_power, reported_temperature)
+        return packet
+
+class DeltaTelemetryDecoder():
+    """Decodes change-only telemetry of any number of houses.
+
+    The houses are told apart by a key given with every packet, e.g. the
+    source address. Fields left out of a delta keep their last value.
+    """
+
+    def __init__(self) -> None:
+        """Initialize the decoder without any houses.
+
+        Returns:
+            None:
+        """
+
+        # Per house: keyframes by sequence and the last decoded telemetry
+        self._keyframes: dict[Hashable, dict[int, tuple[int, float, float, int]]] = {}
+        self._last: dict[Hashable, tuple[int, float, float, int]] = {}
+
+    def decode(
+            self,
+            packet: bytes,
+            key: Hashable = None
+            ) -> tuple[Optional[tuple[int, float, float, int]], Optional[bytes]]:
+        """Decode a keyframe or delta packet.
+
+        Args:
+            packet (bytes): The packet
+            key (Hashable): The house the packet is from
+
+        Returns:
+            tuple[Optional[tuple[int, float, float, int]], Optional[bytes]]: \
+            Device status, powerusage, temperature and time (None if the \
+            keyframe is unknown), and the acknowledgement to send back
+        """
+
+        if packet[0] == KEYFRAME:
+            _, sequence, *values = KEYFRAME_RECORD.unpack_from(packet)
+            keyframes = self._keyframes.setdefault(key, {})
+            keyframes[sequence] = tuple(values)
+            if len(keyframes) > KEYFRAME_HISTORY:
+                del keyframes[next(iter(keyframes))]
+
+            self._last[key] = tuple(values)
+            return self._last[key], ACK_RECORD.pack(ACK, sequence)
+
+        if packet[0] != DELTA:
+            raise ValueError('Not a change-only telemetry packet')
+
+        _, sequence, mask, devices, seconds = DELTA_HEADER.unpack_from(packet)
+        keyframe = self._keyframes.get(key, {}).get(sequence)
+        if keyframe is None:
+            return None, None
+
+        _, key_power, key_temperature, key_time = keyframe
+        _, powerusage, temperature, _ = self._last[key]
+        cursor = DELTA_HEADER.size
+
+        if mask & DELTA_POWER:
+            powerusage = key_power + DELTA_FIELD.unpack_from(packet, cursor)[0] * POWER_STEP
+            cursor += DELTA_FIELD.size
+        if mask & DELTA_TEMPERATURE:
+            temperature = key_temperature + DELTA_FIELD.unpack_from(packet, cursor)[0] * TEMPERATURE_STEP
+
+        self._last[key] = (devices, powerusage, temperature, key_time + seconds)
+        return self._last[key], None
+
+def batch_delta_packetinator(records: list[tuple[int, bytes]]) -> bytes:
+    """Make one packet of change-only telemetry of several houses.
+
+    Args:
+        records (list[tuple[int, bytes]]): House id and encoded packet per house
+
+    Returns:
+        bytes: Packet in bytes
+    """
+
+    return bytes([DELTA_BATCH, len(records)]) + b''.join(
+            house_id.to_bytes(4, 'big') + bytes([len(record)]) + record
+            for house_id, record in records
+            )
+
+def decompile_batch_delta(packet: bytes) -> list[tuple[int, bytes]]:
+    """Split a packet made by batch_delta_packetinator.
+
+    Args:
+        packet (bytes): The packet
+
+    Returns:
+        list[tuple[int, bytes]]: House id and encoded packet per house
+    """
+
+    records = []
+    cursor = 2
+    for _ in range(packet[1]):
+        house_id = int.from_bytes(packet[cursor:cursor+4], 'big')
+        size = packet[cursor+4]
+        records.append((house_id, packet[cursor+5:cursor+5+size]))
+        cursor += 5 + size
+
+    return records
+
+def controlpacket_packetinator(
+        clk: Optional[int] = None,
+        params: Optional[dict] = None,
+        lock: Optional[bool] = None
+        ) -> bytes:
+    """Make a control packet, the inverse of decompile_packet.
+
+    Args:
+        clk (Optional[int]): Clock to sync to
+        params (Optional[dict]): Parameters by name in the param oracle
+        lock (Optional[bool]): Lock (True) or unlock (False) the devices
+
+    Returns:
+        bytes: Packet in bytes
+    """
+
+    flags = 0
+    body: bytes = b''
+
+    # Add clock sync
+    if clk is not None:
+        flags |= 1
+        body += clk.to_bytes(4, 'big')
+
+    # Add parameters
+    if params is not None:
+        flags |= 2
+        body += len(params).to_bytes(1, 'big')
+
+        for paramname, value in params.items():
+            paramid = param_oracle[paramname]['id']
+
+            # Match on the param type and convert the data
+            match param_oracle[paramname]['type']:
+
+                case 'int':
+                    paramdata = int(value).to_bytes(4, 'big')
+
+                case 'bool':
+                    paramdata = bytes([1 if value else 0])
+
+                case 'float':
+                    paramdata = struct.pack('>d', value)
+
+                case _:
+                    raise ValueError('Invalid type')
+
+            body += bytes([paramid, len(paramdata)]) + paramdata
+
+    # Add device lock, flag 4 means unlock
+    if lock is not None:
+        flags |= 8
+        if not lock:
+            flags |= 4
+        body += (0).to_bytes(1, 'big')
+
+    return flags.to_bytes(1, 'big') + body
+
+def signal_packetinator(start: bool) -> bytes:
+    """Make a start/stop signal packet.
+
+    Args:
+        start (bool): Start (True) or stop (False)
+
+    Returns:
+        bytes: Packet in bytes
+    """
+
+    return (1 if start else 0).to_bytes(1, 'big')
+
+# The signal socket is bound on first use, so importing this module
+# does not occupy the signal port
+signal_sock: Optional[socket.socket] = None
 
 def receive_signal() -> bool:
     """function for starting data transfer.
@@ -126,7 +671,11 @@ def receive_signal() -> bool:
         bool:
     """
 
+    global signal_sock
+    if signal_sock is None:
+        signal_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        signal_sock.bind(('', 6969))
+
     # returns true if start signal is received
     d, _ = signal_sock.recvfrom(128)
     return d[0] > 0
-
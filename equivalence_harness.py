@@ -0,0 +1,522 @@
+# equivalence_harness.py
+
+# Import Modules
+from typing import Callable, Iterator, Optional
+from time import perf_counter
+import argparse
+import json
+import sys
+
+import numpy as np
+
+# Own modules
+from house_utils import build_house, find_heatpump, devices_bitmask
+from models import House
+
+
+# An engine runs a house until the end time, yielding the result of every tick
+Engine = Callable[[House, int, int], Iterator[tuple[list[bool], float, float, int]]]
+
+
+def reference_engine(
+        house: House,
+        end_time: int,
+        resolution: int
+        ) -> Iterator[tuple[list[bool], float, float, int]]:
+    """The scalar tick loop main.py runs, the behaviour to match.
+
+    Args:
+        house (House): The house
+        end_time (int): Unix time to run until
+        resolution (int): Seconds per tick
+
+    Returns:
+        Iterator[tuple[list[bool], float, float, int]]: The result of every tick
+    """
+
+    while house.time + resolution <= end_time:
+        house.update_time(resolution)
+        yield house.tick()
+
+
+def adaptive_engine(
+        house: House,
+        end_time: int,
+        resolution: int
+        ) -> Iterator[tuple[list[bool], float, float, int]]:
+    """Adaptive time stepping of House.simulate.
+
+    Args:
+        house (House): The house
+        end_time (int): Unix time to run until
+        resolution (int): Seconds per tick
+
+    Returns:
+        Iterator[tuple[list[bool], float, float, int]]: The result of every tick
+    """
+
+    return house.simulate(end_time, resolution)
+
+
+# Engines by name, fast paths are added here to be checked
+ENGINES: dict[str, Engine] = {
+        'reference': reference_engine,
+        'adaptive': adaptive_engine
+        }
+
+# Metrics of a run compared between the engines
+METRICS: tuple[str, ...] = (
+        'mean_temperature',
+        'min_temperature',
+        'max_temperature',
+        'mean_power',
+        'peak_power',
+        'heatpump_on',
+        'dryer_on',
+        'oven_on',
+        'dryer_starts',
+        'oven_starts'
+        )
+
+
+def make_deterministic(house: House) -> None:
+    """Remove every random part of a house.
+
+    The fluctuations and the random heat loss are set to zero and the
+    dryer and oven never start, what is left must give the same results
+    in every engine.
+
+    Args:
+        house (House): The house to change
+
+    Returns:
+        None:
+    """
+
+    house._bg_power_fluctuation = 0.0
+    house._random_heat_loss_chance = 0.0
+
+    for appliance in house._appliances:
+        appliance._power_fluctuation = 0.0
+        if appliance is find_heatpump(house):
+            appliance._heating_fluctuation = 0.0
+        else:
+            appliance._state_coeffs = [0.0]
+
+
+def lock_schedule(
+        start: int,
+        duration: int,
+        lock_hours: float,
+        period_hours: float
+        ) -> list[tuple[int, bool]]:
+    """Lock the heatpump for a while at the start of every period.
+
+    Args:
+        start (int): Unix time the run starts
+        duration (int): Seconds to run
+        lock_hours (float): Hours locked per period, 0 for no locking
+        period_hours (float): Hours per period
+
+    Returns:
+        list[tuple[int, bool]]: Unix time and lock state of every change
+    """
+
+    if lock_hours <= 0:
+        return []
+
+    events = []
+    for period_start in range(start, start + duration, int(period_hours * 3600)):
+        events.append((period_start, True))
+        events.append((period_start + int(lock_hours * 3600), False))
+
+    return events
+
+
+def run_engine(
+        engine: Engine,
+        house: House,
+        duration: int,
+        resolution: int,
+        events: list[tuple[int, bool]]
+        ) -> dict[str, np.ndarray]:
+    """Run a house with an engine, locking the heatpump on schedule.
+
+    Args:
+        engine (Engine): The engine
+        house (House): The house, at its start time
+        duration (int): Seconds to run
+        resolution (int): Seconds per tick
+        events (list[tuple[int, bool]]): Lock schedule from lock_schedule
+
+    Returns:
+        dict[str, np.ndarray]: time, devices, power and temperature of every tick
+    """
+
+    heatpump = find_heatpump(house)
+    end_time = house.time + duration
+    results = []
+
+    # Run up to every lock change, then apply it between ticks
+    for time, lock in events + [(end_time, None)]:
+        results.extend(engine(house, min(time, end_time), resolution))
+        if lock is not None and heatpump is not None:
+            heatpump.power_locker(lock)
+
+    return {
+            'time': np.array([result[3] for result in results], dtype=np.int64),
+            'devices': np.array([devices_bitmask(result[0]) for result in results], dtype=np.uint8),
+            'power': np.array([result[1] for result in results]),
+            'temperature': np.array([result[2] for result in results])
+            }
+
+
+def run_metrics(run: dict[str, np.ndarray]) -> dict[str, float]:
+    """Summarize a run, one independent sample per metric.
+
+    Args:
+        run (dict[str, np.ndarray]): Output of run_engine
+
+    Returns:
+        dict[str, float]: Value of every metric in METRICS
+    """
+
+    on = (run['devices'][:, None] >> np.arange(3)) & 1
+    starts = np.diff(on, axis=0, prepend=0) > 0
+
+    return {
+            'mean_temperature': float(run['temperature'].mean()),
+            'min_temperature': float(run['temperature'].min()),
+            'max_temperature': float(run['temperature'].max()),
+            'mean_power': float(run['power'].mean()),
+            'peak_power': float(run['power'].max()),
+            'heatpump_on': float(on[:, 0].mean()),
+            'dryer_on': float(on[:, 1].mean()),
+            'oven_on': float(on[:, 2].mean()),
+            'dryer_starts': float(starts[:, 1].sum()),
+            'oven_starts': float(starts[:, 2].sum())
+            }
+
+
+def ks_2samp(a: np.ndarray, b: np.ndarray) -> tuple[float, float]:
+    """Two sample Kolmogorov-Smirnov test.
+
+    Args:
+        a (np.ndarray): First sample
+        b (np.ndarray): Second sample
+
+    Returns:
+        tuple[float, float]: The statistic and the asymptotic p-value
+    """
+
+    a = np.sort(np.asarray(a, dtype=np.float64))
+    b = np.sort(np.asarray(b, dtype=np.float64))
+    values = np.concatenate((a, b))
+    statistic = float(np.abs(
+        np.searchsorted(a, values, side='right') / len(a) - \
+        np.searchsorted(b, values, side='right') / len(b)
+        ).max())
+
+    # Asymptotic Kolmogorov distribution with the small sample correction
+    en = np.sqrt(len(a) * len(b) / (len(a) + len(b)))
+    lam = (en + 0.12 + 0.11 / en) * statistic
+    if lam < 1e-3:
+        return statistic, 1.0
+
+    k = np.arange(1, 101)
+    p_value = 2 * np.sum((-1.0)**(k - 1) * np.exp(-2 * k**2 * lam**2))
+
+    return statistic, float(np.clip(p_value, 0.0, 1.0))
+
+
+def relative_error(reference: np.ndarray, fast: np.ndarray) -> float:
+    """Get the largest difference, relative to the reference where it is above 1.
+
+    Rounding differences grow with the values, so a fixed tolerance would
+    depend on the units and the temperature range.
+
+    Args:
+        reference (np.ndarray): Values of the reference
+        fast (np.ndarray): Values of the engine
+
+    Returns:
+        float: The largest scaled difference, 0 for empty runs
+    """
+
+    if len(reference) == 0:
+        return 0.0
+
+    return float((np.abs(reference - fast) / np.maximum(np.abs(reference), 1.0)).max())
+
+
+def compare_exact(
+        house_data: dict,
+        appliance_data: dict,
+        coefficients: dict,
+        engine: str,
+        duration: int,
+        resolution: int,
+        events: list[tuple[int, bool]],
+        seed: Optional[int]
+        ) -> dict:
+    """Compare an engine with the reference on a deterministic house.
+
+    Args:
+        house_data (dict): Settings of the house
+        appliance_data (dict): The content of appliance_data.json
+        coefficients (dict): The content of coefficients.json
+        engine (str): Name of the engine in ENGINES
+        duration (int): Seconds to run
+        resolution (int): Seconds per tick
+        events (list[tuple[int, bool]]): Lock schedule
+        seed (Optional[int]): Seed of the houses
+
+    Returns:
+        dict: Largest differences, relative to the values above 1, and the run times
+    """
+
+    runs = {}
+    seconds = {}
+    for name in ('reference', engine):
+        house = build_house(house_data, appliance_data, coefficients, seed)
+        make_deterministic(house)
+        start = perf_counter()
+        runs[name] = run_engine(ENGINES[name], house, duration, resolution, events)
+        seconds[name] = perf_counter() - start
+
+    reference, fast = runs['reference'], runs[engine]
+    if len(reference['time']) != len(fast['time']) or \
+            (reference['time'] != fast['time']).any():
+        return {'ticks': len(fast['time']), 'time_mismatch': True, 'seconds': seconds}
+
+    return {
+            'ticks': len(fast['time']),
+            'time_mismatch': False,
+            'device_mismatches': int((reference['devices'] != fast['devices']).sum()),
+            'power_error': relative_error(reference['power'], fast['power']),
+            'temperature_error': relative_error(reference['temperature'], fast['temperature']),
+            'seconds': seconds
+            }
+
+
+def compare_statistical(
+        house_data: dict,
+        appliance_data: dict,
+        coefficients: dict,
+        engine: str,
+        duration: int,
+        resolution: int,
+        events: list[tuple[int, bool]],
+        replicas: int,
+        seed: int
+        ) -> dict:
+    """Compare the metric distributions of an engine and the reference.
+
+    Every replica runs the house with its own seed in both engines, the
+    engines use the same seeds.
+
+    Args:
+        house_data (dict): Settings of the house
+        appliance_data (dict): The content of appliance_data.json
+        coefficients (dict): The content of coefficients.json
+        engine (str): Name of the engine in ENGINES
+        duration (int): Seconds to run
+        resolution (int): Seconds per tick
+        events (list[tuple[int, bool]]): Lock schedule
+        replicas (int): Runs per engine
+        seed (int): Seed of the first replica
+
+    Returns:
+        dict: Per metric means, KS statistic and p-value, and the run times
+    """
+
+    samples = {name: {metric: [] for metric in METRICS} for name in ('reference', engine)}
+    seconds = {'reference': 0.0, engine: 0.0}
+
+    for replica in range(replicas):
+        for name in ('reference', engine):
+            house = build_house(house_data, appliance_data, coefficients, seed + replica)
+            start = perf_counter()
+            run = run_engine(ENGINES[name], house, duration, resolution, events)
+            seconds[name] += perf_counter() - start
+
+            for metric, value in run_metrics(run).items():
+                samples[name][metric].append(value)
+
+    metrics = {}
+    for metric in METRICS:
+        reference = np.array(samples['reference'][metric])
+        fast = np.array(samples[engine][metric])
+        statistic, p_value = ks_2samp(reference, fast)
+        metrics[metric] = {
+                'reference': float(reference.mean()),
+                'fast': float(fast.mean()),
+                'delta': float(fast.mean() - reference.mean()),
+                'ks': statistic,
+                'p_value': p_value
+                }
+
+    return {'metrics': metrics, 'seconds': seconds}
+
+
+def run_harness(
+        house_settings: dict,
+        appliance_data: dict,
+        coefficients: dict,
+        engine: str = 'adaptive',
+        days: float = 2,
+        resolution: int = 60,
+        replicas: int = 40,
+        lock_hours: float = 2,
+        period_hours: float = 8,
+        seed: int = 0,
+        alpha: float = 0.01,
+        exact_tolerance: float = 1e-9
+        ) -> dict:
+    """Check an engine against the reference for every house.
+
+    A house passes when its deterministic run matches within the tolerance
+    and no metric differs significantly. The significance level is split
+    over the metrics (Bonferroni).
+
+    Args:
+        house_settings (dict): Houses to check, like house_settings.json
+        appliance_data (dict): The content of appliance_data.json
+        coefficients (dict): The content of coefficients.json
+        engine (str): Name of the engine in ENGINES
+        days (float): Simulated days per run
+        resolution (int): Seconds per tick
+        replicas (int): Runs per engine for the statistical comparison
+        lock_hours (float): Hours the heatpump is locked per period
+        period_hours (float): Hours per lock period
+        seed (int): Base seed
+        alpha (float): Significance level per house
+        exact_tolerance (float): Allowed relative difference of the deterministic runs
+
+    Returns:
+        dict: Report per house and whether all houses passed
+    """
+
+    if engine not in ENGINES:
+        raise ValueError('Unknown engine')
+
+    duration = int(days * 86400)
+    houses = {}
+
+    for house_nr, house_data in house_settings.items():
+        events = lock_schedule(house_data["start time"], duration, lock_hours, period_hours)
+
+        exact = compare_exact(
+                house_data, appliance_data, coefficients,
+                engine, duration, resolution, events, seed
+                )
+        statistical = compare_statistical(
+                house_data, appliance_data, coefficients,
+                engine, duration, resolution, events, replicas, seed
+                )
+
+        exact_passed = not exact['time_mismatch'] and \
+                exact['device_mismatches'] == 0 and \
+                exact['power_error'] <= exact_tolerance and \
+                exact['temperature_error'] <= exact_tolerance
+        statistical_passed = all(
+                metric['p_value'] >= alpha / len(METRICS)
+                for metric in statistical['metrics'].values()
+                )
+
+        houses[house_nr] = {
+                'exact': exact,
+                'statistical': statistical,
+                'speedup': statistical['seconds']['reference'] / statistical['seconds'][engine],
+                'passed': exact_passed and statistical_passed
+                }
+
+    return {
+            'engine': engine,
+            'houses': houses,
+            'passed': all(house['passed'] for house in houses.values())
+            }
+
+
+def format_report(report: dict) -> str:
+    """Format a report of run_harness for printing.
+
+    Args:
+        report (dict): The report
+
+    Returns:
+        str: Human readable report
+    """
+
+    lines = [f"engine: {report['engine']}"]
+
+    for house_nr, house in report['houses'].items():
+        exact = house['exact']
+        lines.append(
+                f"house {house_nr}: {'PASS' if house['passed'] else 'FAIL'}, "
+                f"speedup {house['speedup']:.2f}x"
+                )
+
+        if exact['time_mismatch']:
+            lines.append("  exact: tick times differ")
+        else:
+            lines.append(
+                    f"  exact ({exact['ticks']} ticks): "
+                    f"device mismatches {exact['device_mismatches']}, "
+                    f"relative power error {exact['power_error']:.3g}, "
+                    f"relative temperature error {exact['temperature_error']:.3g}, "
+                    f"speedup {exact['seconds']['reference'] / exact['seconds'][report['engine']]:.2f}x"
+                    )
+
+        for metric, values in house['statistical']['metrics'].items():
+            lines.append(
+                    f"  {metric}: reference {values['reference']:.4g}, "
+                    f"fast {values['fast']:.4g}, delta {values['delta']:+.3g}, "
+                    f"KS {values['ks']:.3f} (p {values['p_value']:.3f})"
+                    )
+
+    lines.append('PASSED' if report['passed'] else 'FAILED')
+    return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Check a fast simulation engine against the scalar models")
+    parser.add_argument('--engine', default='adaptive', choices=[name for name in ENGINES if name != 'reference'])
+    parser.add_argument('--house', action='append', default=None, help="House number in house_settings.json, all if not given")
+    parser.add_argument('--days', type=float, default=2)
+    parser.add_argument('--resolution', type=int, default=60)
+    parser.add_argument('--replicas', type=int, default=40)
+    parser.add_argument('--lock-hours', type=float, default=2)
+    parser.add_argument('--period-hours', type=float, default=8)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--alpha', type=float, default=0.01)
+    args = parser.parse_args()
+
+    with open('coefficients.json', 'r') as fd:
+        coefficients = json.load(fd)
+
+    with open('house_settings.json', 'r') as fd:
+        house_setting = json.load(fd)
+
+    with open('appliance_data.json', 'r') as fd:
+        appliance_data = json.load(fd)
+
+    if args.house:
+        house_setting = {house_nr: house_setting[house_nr] for house_nr in args.house}
+
+    report = run_harness(
+            house_setting,
+            appliance_data,
+            coefficients,
+            args.engine,
+            args.days,
+            args.resolution,
+            args.replicas,
+            args.lock_hours,
+            args.period_hours,
+            args.seed,
+            args.alpha
+            )
+
+    print(format_report(report))
+    sys.exit(0 if report['passed'] else 1)
@@ -0,0 +1,247 @@
+# exogenous.py
+
+# Import Modules
+from typing import Self, Union
+from struct import Struct
+import argparse
+import os
+
+import numpy as np
+
+
+# Channel names used by the models
+OUTDOOR_TEMPERATURE: str = 'outdoor_temperature'
+TARIFF: str = 'tariff'
+
+# File layout: header, one record per channel, then the float32 values
+# channel by channel so every channel is one contiguous block
+MAGIC: bytes = b'HEXO'
+VERSION: int = 1
+HEADER: Struct = Struct('<4sB?qqII')
+CHANNEL: Struct = Struct('<32sd')
+DTYPE: np.dtype = np.dtype('<f4')
+
+# Profiles opened in this process, by real path
+_profiles: dict[str, 'ExogenousProfile'] = {}
+
+
+class ExogenousProfile():
+    """Time series of external inputs read through a memory map.
+
+    The values are sampled at a fixed step, so a lookup is an index
+    calculation and a linear interpolation. Nothing is parsed or copied
+    when opening, the pages are shared by every process mapping the file.
+    A periodic profile repeats after its last sample, e.g. a year of
+    weather for any year.
+    """
+
+    def __init__(self: Self, path: str) -> None:
+        """Open a profile written by write_profile.
+
+        Args:
+            self (Self): self
+            path (str): The profile file
+
+        Returns:
+            None:
+        """
+
+        with open(path, 'rb') as fd:
+            magic, version, self.periodic, self.start, self.step, self.rows, channels = \
+                    HEADER.unpack(fd.read(HEADER.size))
+            if magic != MAGIC or version != VERSION:
+                raise ValueError("Not an exogenous profile")
+
+            records = [CHANNEL.unpack(fd.read(CHANNEL.size)) for _ in range(channels)]
+
+        self.path: str = path
+        self.channels: dict[str, int] = {
+                name.rstrip(b'\0').decode(): i for i, (name, _) in enumerate(records)
+                }
+        self._means: list[float] = [mean for _, mean in records]
+
+        self._data: np.ndarray = np.memmap(
+                path,
+                dtype=DTYPE,
+                mode='r',
+                offset=HEADER.size + channels * CHANNEL.size,
+                shape=(channels, self.rows)
+                ).view(np.ndarray)
+
+        # Period for wrapping, one step after the last sample joins the first
+        self._period: int = self.rows * self.step if self.periodic else \
+                (self.rows - 1) * self.step
+
+    def __contains__(self: Self, channel: str) -> bool:
+        return channel in self.channels
+
+    def mean(self: Self, channel: str) -> float:
+        """Get the mean of a channel, stored when writing.
+
+        Args:
+            self (Self): self
+            channel (str): Name of the channel
+
+        Returns:
+            float: The mean over all samples
+        """
+
+        return self._means[self.channels[channel]]
+
+    def value(self: Self, channel: str, time: float) -> float:
+        """Get the interpolated value of a channel at a time.
+
+        Args:
+            self (Self): self
+            channel (str): Name of the channel
+            time (float): Unix time
+
+        Returns:
+            float: The value, a non periodic profile holds its first and last values
+        """
+
+        column = self._data[self.channels[channel]]
+        offset = float(time - self.start)
+
+        if self.periodic:
+            offset %= self._period
+        elif offset <= 0:
+            return float(column[0])
+        elif offset >= self._period:
+            return float(column[-1])
+
+        position = offset / self.step
+        i = int(position)
+        fraction = position - i
+        j = i + 1 if i + 1 < self.rows else 0
+
+        # Interpolate in float64 like values, float32 would round it
+        low, high = float(column[i]), float(column[j])
+        return low + (high - low) * fraction
+
+    def values(self: Self, channel: str, times: np.ndarray) -> np.ndarray:
+        """Get the interpolated values of a channel at many times.
+
+        Args:
+            self (Self): self
+            channel (str): Name of the channel
+            times (np.ndarray): Unix times
+
+        Returns:
+            np.ndarray: The values
+        """
+
+        column = self._data[self.channels[channel]]
+        offset = np.asarray(times, dtype=np.float64) - self.start
+
+        if self.periodic:
+            offset %= self._period
+        else:
+            offset = np.clip(offset, 0, self._period)
+
+        position = offset / self.step
+        i = np.minimum(position.astype(np.int64), self.rows - 1)
+        fraction = position - i
+        j = np.where(i + 1 < self.rows, i + 1, 0 if self.periodic else self.rows - 1)
+
+        return column[i] + (column[j] - column[i]) * fraction
+
+    def average(
+            self: Self,
+            channel: str,
+            start: Union[float, np.ndarray],
+            end: Union[float, np.ndarray]
+            ) -> Union[float, np.ndarray]:
+        """Get the average of a channel over intervals, from their end points.
+
+        Args:
+            self (Self): self
+            channel (str): Name of the channel
+            start (Union[float, np.ndarray]): Unix time the intervals start
+            end (Union[float, np.ndarray]): Unix time the intervals end
+
+        Returns:
+            Union[float, np.ndarray]: The average per interval
+        """
+
+        if isinstance(start, np.ndarray) or isinstance(end, np.ndarray):
+            return (self.values(channel, start) + self.values(channel, end)) / 2
+
+        return (self.value(channel, start) + self.value(channel, end)) / 2
+
+
+def open_profile(path: str) -> ExogenousProfile:
+    """Open a profile, houses in the same process share one mapping.
+
+    Args:
+        path (str): The profile file
+
+    Returns:
+        ExogenousProfile: The profile
+    """
+
+    key = os.path.realpath(path)
+    if key not in _profiles:
+        _profiles[key] = ExogenousProfile(path)
+
+    return _profiles[key]
+
+
+def write_profile(
+        path: str,
+        start: int,
+        step: int,
+        channels: dict[str, np.ndarray],
+        periodic: bool = True
+        ) -> None:
+    """Write a profile of equally long channels sampled every step.
+
+    Args:
+        path (str): The profile file
+        start (int): Unix time of the first sample
+        step (int): Seconds between samples
+        channels (dict[str, np.ndarray]): Values by channel name
+        periodic (bool): Repeat the profile after the last sample
+
+    Returns:
+        None:
+    """
+
+    columns = [np.asarray(values, dtype=DTYPE) for values in channels.values()]
+    rows = len(columns[0]) if columns else 0
+    if any(len(column) != rows for column in columns):
+        raise ValueError("Channels have different lengths")
+    if rows < 2:
+        raise ValueError("A profile needs at least two samples")
+
+    with open(path, 'wb') as fd:
+        fd.write(HEADER.pack(MAGIC, VERSION, periodic, start, step, rows, len(columns)))
+        for name, column in zip(channels, columns):
+            fd.write(CHANNEL.pack(name.encode(), float(column.mean(dtype=np.float64))))
+        for column in columns:
+            fd.write(column.tobytes())
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Convert a CSV time series to a memory mapped exogenous profile")
+    parser.add_argument('data', help="CSV with a header, unix time in the first column")
+    parser.add_argument('output')
+    parser.add_argument('--step', type=int, default=60, help="Seconds between the resampled values")
+    parser.add_argument('--not-periodic', action='store_true', help="Hold the end values instead of repeating")
+    args = parser.parse_args()
+
+    with open(args.data, 'r') as fd:
+        names = [name.strip() for name in fd.readline().split(',')]
+        data = np.loadtxt(fd, delimiter=',', ndmin=2)
+
+    # Resample to the fixed step
+    data = data[np.argsort(data[:, 0])]
+    times = np.arange(data[0, 0], data[-1, 0] + 1, args.step)
+
+    write_profile(
+            args.output,
+            int(times[0]),
+            args.step,
+            {name: np.interp(times, data[:, 0], data[:, i]) for i, name in enumerate(names) if i > 0},
+            not args.not_periodic
+            )
@@ -0,0 +1,211 @@
+# flexibility_index.py
+
+# Import Modules
+from typing import Self, Hashable, NamedTuple, Optional
+from heapq import heappush, heappop, heapify
+from threading import Lock
+
+# Own modules
+from models import House, Heatpump
+from house_utils import find_heatpump
+
+
+class Flexibility(NamedTuple):
+    """A heatpump that can be locked to shed load."""
+
+    key: Hashable
+    margin: float
+    kw: float
+
+
+def heatpump_draw(heatpump: Heatpump) -> float:
+    """Get the kW the heatpump draws in its current state.
+
+    Args:
+        heatpump (Heatpump): The heatpump
+
+    Returns:
+        float: Nominal kW draw, 0 when it is off or locked
+    """
+
+    if heatpump._power_lock or not heatpump.power_state:
+        return 0.0
+
+    if heatpump._stabilizer_state:
+        return heatpump._stabilizer_heating
+
+    return heatpump._power_usage
+
+
+class FlexibilityIndex():
+    """Index of the heatpumps that can be locked, by temperature margin.
+
+    Only unlocked heatpumps drawing power are in the index. Every update
+    pushes a new heap entry and makes the previous entry of the house
+    stale, stale entries are dropped when they reach the top or when the
+    heap is rebuilt. Updates cost O(log n) and a query returning k houses
+    costs O(k log n) amortized, whatever the size of the fleet.
+    """
+
+    def __init__(self: Self) -> None:
+        """Initialize an empty index.
+
+        Args:
+            self (Self): self
+
+        Returns:
+            None:
+        """
+
+        # Heap of (-margin, version, key), the version identifies live entries
+        self._heap: list[tuple[float, int, Hashable]] = []
+        self._live: dict[Hashable, tuple[int, float, float]] = {}
+        self._version: int = 0
+        self._lock: Lock = Lock()
+
+    def __len__(self: Self) -> int:
+        return len(self._live)
+
+    def update(
+            self: Self,
+            key: Hashable,
+            temperature: float,
+            target_temperature: float,
+            kw: float,
+            locked: bool
+            ) -> None:
+        """Update the state of a house.
+
+        Args:
+            self (Self): self
+            key (Hashable): The house
+            temperature (float): Temperature of the house
+            target_temperature (float): Target temperature of the heatpump
+            kw (float): kW the heatpump draws
+            locked (bool): The heatpump is locked
+
+        Returns:
+            None:
+        """
+
+        with self._lock:
+            if locked or kw <= 0:
+                self._live.pop(key, None)
+                return
+
+            self._version += 1
+            margin = temperature - target_temperature
+            self._live[key] = (self._version, margin, kw)
+            heappush(self._heap, (-margin, self._version, key))
+
+            # Rebuild when the stale entries dominate
+            if len(self._heap) > 2 * len(self._live) + 64:
+                self._heap = [
+                        (-margin, version, key)
+                        for key, (version, margin, _) in self._live.items()
+                        ]
+                heapify(self._heap)
+
+    def update_house(self: Self, key: Hashable, house: House) -> None:
+        """Update the state of a house from the model.
+
+        Args:
+            self (Self): self
+            key (Hashable): The house
+            house (House): The model of the house
+
+        Returns:
+            None:
+        """
+
+        heatpump = find_heatpump(house)
+        if heatpump is None:
+            self.discard(key)
+            return
+
+        self.update(
+                key,
+                house.current_temperature,
+                heatpump._target_temperature,
+                heatpump_draw(heatpump),
+                heatpump._power_lock
+                )
+
+    def track(self: Self, key: Hashable, house: House) -> None:
+        """Keep a house up to date in the index after every tick.
+
+        Args:
+            self (Self): self
+            key (Hashable): The house
+            house (House): The model of the house
+
+        Returns:
+            None:
+        """
+
+        house.add_listener(lambda house: self.update_house(key, house))
+        self.update_house(key, house)
+
+    def discard(self: Self, key: Hashable) -> None:
+        """Remove a house, e.g. right after sending it a lock.
+
+        Args:
+            self (Self): self
+            key (Hashable): The house
+
+        Returns:
+            None:
+        """
+
+        with self._lock:
+            self._live.pop(key, None)
+
+    def query(
+            self: Self,
+            kw: float,
+            max_houses: Optional[int] = None,
+            min_margin: float = 0.0
+            ) -> list[Flexibility]:
+        """Find the houses with the most margin to lock to shed a load.
+
+        Houses are taken by decreasing margin until their kW add up to the
+        requested load, so fewer kW are returned when there is not enough
+        flexibility.
+
+        Args:
+            self (Self): self
+            kw (float): Load to shed
+            max_houses (Optional[int]): Most houses to return
+            min_margin (float): Least margin above the target temperature
+
+        Returns:
+            list[Flexibility]: The houses to lock, largest margin first
+        """
+
+        chosen: list[Flexibility] = []
+        popped: list[tuple[float, int, Hashable]] = []
+        total = 0.0
+
+        with self._lock:
+            while self._heap and total < kw and \
+                    (max_houses is None or len(chosen) < max_houses):
+                entry = heappop(self._heap)
+                negative_margin, version, key = entry
+
+                # Drop entries replaced by a later update
+                live = self._live.get(key)
+                if live is None or live[0] != version:
+                    continue
+
+                popped.append(entry)
+                if -negative_margin < min_margin:
+                    break
+
+                chosen.append(Flexibility(key, -negative_margin, live[2]))
+                total += live[2]
+
+            # The query does not change the index
+            for entry in popped:
+                heappush(self._heap, entry)
+
+        return chosen
@@ -0,0 +1,274 @@
+# house_utils.py
+
+# Import Modules
+from typing import Optional, Callable, Any
+from collections import deque
+
+from numpy.random import SeedSequence
+
+# Own modules
+from models import House, Heatpump, Oven, Dryer
+from exogenous import open_profile
+from communication_utils import param_oracle
+
+
+# Settings a param can change: name -> (model owning it, attribute),
+# a model of None is the house itself
+PARAM_TARGETS: dict[str, tuple[Optional[type], str]] = {
+        'target_temperature': (Heatpump, '_target_temperature'),
+        'heating_fluctuation': (Heatpump, '_heating_fluctuation'),
+        'heatpump_power_fluctuation': (Heatpump, '_power_fluctuation'),
+        'bg_power_fluctuation': (None, '_bg_power_fluctuation'),
+        'random_heat_loss_chance': (None, '_random_heat_loss_chance'),
+        'dryer_allowed_cycles': (Dryer, '_allowed_cycles'),
+        'oven_allowed_cycles': (Oven, '_allowed_cycles'),
+        'dryer_power_fluctuation': (Dryer, '_power_fluctuation'),
+        'oven_power_fluctuation': (Oven, '_power_fluctuation')
+        }
+
+# Realistic values of the settings in PARAM_TARGETS: name -> (low, high),
+# around what build_house configures, e.g. to generate control load
+PARAM_RANGES: dict[str, tuple[float, float]] = {
+        'target_temperature': (18.0, 23.0),
+        'heating_fluctuation': (0.0, 0.1),
+        'heatpump_power_fluctuation': (0.0, 0.05),
+        'bg_power_fluctuation': (0.0, 0.05),
+        'random_heat_loss_chance': (0.0, 0.02),
+        'dryer_allowed_cycles': (1, 3),
+        'oven_allowed_cycles': (1, 3),
+        'dryer_power_fluctuation': (0.0, 0.05),
+        'oven_power_fluctuation': (0.0, 0.05)
+        }
+
+ParamHandler = Callable[[House, Any], None]
+
+
+def _param_handler(model: Optional[type], attribute: str) -> ParamHandler:
+    """Make the function setting a param on a house.
+
+    Args:
+        model (Optional[type]): Appliance type owning the setting, None for the house
+        attribute (str): Attribute holding the setting
+
+    Returns:
+        ParamHandler: Function taking the house and the value
+    """
+
+    if model is None:
+        def handler(house: House, value: Any) -> None:
+            setattr(house, attribute, value)
+    else:
+        def handler(house: House, value: Any) -> None:
+            for appliance in house._appliances:
+                if type(appliance) == model:
+                    setattr(appliance, attribute, value)
+
+    return handler
+
+
+# Handlers of the params in the oracle, built once
+param_handlers: dict[str, ParamHandler] = {
+        name: _param_handler(*PARAM_TARGETS[name])
+        for name in param_oracle if name in PARAM_TARGETS
+        }
+
+
+def build_house(
+        house_data: dict,
+        appliance_data: dict,
+        coefficients: dict,
+        seed: Optional[int] = None
+        ) -> House:
+    """Build a house with its appliances from the settings files.
+
+    An optional "exogenous profile" setting names a profile file with the
+    outdoor temperature and tariff of the house.
+
+    Args:
+        house_data (dict): Settings of one house from house_settings.json
+        appliance_data (dict): The content of appliance_data.json
+        coefficients (dict): The content of coefficients.json
+        seed (Optional[int]): Seed, every model gets its own child seed
+
+    Returns:
+        House: The configured house (heatpump, dryer, oven)
+    """
+
+    # Configure the oven, according to the house settings
+    oven_data = appliance_data["oven"][house_data["oven"]][house_data["mode"]]
+
+    # Configure the dryer, according to the house settings
+    dryer_data = appliance_data["dryer"][house_data["dryer"]]
+
+    # Spawn independent seeds for the house and the appliances
+    house_seed, heatpump_seed, dryer_seed, oven_seed = SeedSequence(seed).spawn(4)
+
+    # Creating oven appliance for house
+    oven = Oven(power_usage=oven_data, power_fluctuation=0.02, controllable=False, state_coeffs=coefficients["oven"], allowed_cycles=1, cycle_time_range=(30, 120), seed=oven_seed)
+
+    # Creating dryer appliance for house
+    dryer = Dryer(power_usage=dryer_data, power_fluctuation=0.02, controllable=False, state_coeffs=coefficients["dryer"], allowed_cycles=1, cycle_time_range=(60,120), seed=dryer_seed)
+
+    # Creating heat pump appliance for house
+    heatpump = Heatpump(1.5, 0, True, heating_multiplier=3, heating_fluctuation=0.05, target_temperature=house_data["target temperature"], seed=heatpump_seed)
+
+    # Creating the house object
+    return House(
+            house_data["energy rating"],
+            house_data["size"],
+            house_data["height"],
+            house_data["start temperature"],
+            house_data["start time"],
+            house_data["active days"],
+            [heatpump, dryer, oven],
+            coefficients["background"],
+            0.01,
+            0.01,
+            seed=house_seed,
+            exogenous=open_profile(house_data["exogenous profile"]) \
+                    if house_data.get("exogenous profile") else None
+            )
+
+
+def find_heatpump(house: House) -> Optional[Heatpump]:
+    """Find the heatpump of a house.
+
+    Args:
+        house (House): The house to search
+
+    Returns:
+        Optional[Heatpump]: The first heatpump, or None if there is none
+    """
+
+    for appliance in house._appliances:
+        if type(appliance) == Heatpump:
+            return appliance
+
+    return None
+
+
+def devices_bitmask(devicelist: list[bool]) -> int:
+    """Pack the device power states into the telemetry bitmask.
+
+    Args:
+        devicelist (list[bool]): Power states in appliance order
+
+    Returns:
+        int: Bitmask with bit i set if appliance i is on
+    """
+
+    devices = 0
+    for i, device in enumerate(devicelist):
+        devices += 2**i if device else 0
+
+    return devices
+
+
+def compile_params(params: dict) -> list[tuple[ParamHandler, Any]]:
+    """Look up the handlers of decompiled params.
+
+    Params without a handler (like param1 to param4) are ignored.
+
+    Args:
+        params (dict): Params by name, from decompile_packet
+
+    Returns:
+        list[tuple[ParamHandler, Any]]: Handler and value of every param
+    """
+
+    return [
+            (param_handlers[name], value)
+            for name, value in params.items() if name in param_handlers
+            ]
+
+
+def apply_params(house: House, updates: list[tuple[ParamHandler, Any]]) -> None:
+    """Apply compiled params to a house.
+
+    Args:
+        house (House): The house to change
+        updates (list[tuple[ParamHandler, Any]]): Output of compile_params
+
+    Returns:
+        None:
+    """
+
+    for handler, value in updates:
+        handler(house, value)
+
+
+class ParamQueue():
+    """Hands param updates from a listener thread to the tick thread.
+
+    The params of a packet are queued as one item and the tick thread
+    applies everything queued between ticks, so a tick never sees half a
+    packet. Appending and popping a deque is atomic, neither side locks.
+    """
+
+    def __init__(self) -> None:
+        self._queue: deque = deque()
+
+    def put(self, params: dict) -> None:
+        """Queue the params of a packet.
+
+        Args:
+            params (dict): Params by name, from decompile_packet
+
+        Returns:
+            None:
+        """
+
+        updates = compile_params(params)
+        if updates:
+            self._queue.append(updates)
+
+    def apply(self, house: House) -> None:
+        """Apply all queued params, call between ticks.
+
+        Args:
+            house (House): The house to change
+
+        Returns:
+            None:
+        """
+
+        while self._queue:
+            apply_params(house, self._queue.popleft())
+
+
+def apply_controlpacket(
+        house: House,
+        packet: tuple[int, int, dict, int],
+        queue: Optional[ParamQueue] = None
+        ) -> None:
+    """Apply a decompiled control packet to a house.
+
+    Args:
+        house (House): The house to control
+        packet (tuple[int, int, dict, int]): Output of decompile_packet
+        queue (Optional[ParamQueue]): Queue the params for the tick thread instead of applying them
+
+    Returns:
+        None:
+    """
+
+    flags, clk, params, _ = packet
+
+    # Check if the param flag is set
+    if flags & 2 > 0 and params:
+        if queue is not None:
+            queue.put(params)
+        else:
+            apply_params(house, compile_params(params))
+
+    # Check if the device flag is set, the lock flag is inverted
+    if flags & 8 > 0:
+        heatpump = find_heatpump(house)
+        if heatpump is not None:
+            heatpump.power_locker(not flags & 4 > 0)
+
+    # Check if clk flag in packet is set
+    if flags & 1 > 0:
+        if clk > house.time:
+            # Set house clk to recieved clk in the packet
+            house.set_time(clk)
@@ -8,14 +8,22 @@ from threading import Thread
 from time import sleep
 
 # Own modules
-from communication_utils import decompile_packet, datatrans_packetinator, receive_signal
-from models import House, Heatpump, Oven, Dryer
+from communication_utils import decompile_packet, datatrans_packetinator, receive_signal, \
+        DeltaTelemetryEncoder
+from house_utils import build_house, find_heatpump, devices_bitmask, apply_controlpacket, ParamQueue
+from recording import Recorder
 
 
 # GLOBAL VARS
 CONTROLPROTOCOLPORT: int = 42069
 STOPTHREADS = False
 
+# Set to a path to record the run (see recording.py)
+RECORDFILE: Optional[str] = None
+
+# Send change-only telemetry (see DeltaTelemetryEncoder)
+DELTATELEMETRY: bool = False
+
 with open('coefficients.json', 'r') as fd:
     coefficients = json.load(fd)
 
@@ -38,6 +46,13 @@ controlprotocolsock: socket.socket = socket.socket(
 controlprotocolsock.bind(('', CONTROLPROTOCOLPORT))
 controlprotocolsock.listen()
 
+# The acknowledgements of change-only telemetry arrive on the data socket
+encoder: Optional[DeltaTelemetryEncoder] = None
+if DELTATELEMETRY:
+    encoder = DeltaTelemetryEncoder()
+    datasock.bind(('', 0))
+    datasock.setblocking(False)
+
 def transmit_data(
         target_ip: str,
         port: int,
@@ -48,14 +63,29 @@ def transmit_data(
         ) -> None:
 
     # Make the packet
-    packet: bytes = datatrans_packetinator(
-            devices,
-            powerusage,
-            temperature,
-            time
-            )
+    if encoder is not None:
+        while True:
+            try:
+                encoder.acknowledge(datasock.recv(16))
+            except BlockingIOError:
+                break
 
-    datasock.sendto(packet, (target_ip, port))
+        packet: Optional[bytes] = encoder.encode(
+                devices,
+                powerusage,
+                temperature,
+                time
+                )
+    else:
+        packet = datatrans_packetinator(
+                devices,
+                powerusage,
+                temperature,
+                time
+                )
+
+    if packet is not None:
+        datasock.sendto(packet, (target_ip, port))
 
 
 def receive_controlpacket() -> Optional[tuple[int, int, dict, int]]:
@@ -63,7 +93,14 @@ def receive_controlpacket() -> Optional[tuple[int, int, dict, int]]:
         csock, _ = controlprotocolsock.accept()
         packet = csock.recv(1024)
         csock.close()
-        return decompile_packet(packet)
+
+        # The recorder records and applies the packet, under its lock
+        if recorder is not None:
+            return recorder.packet(packet)
+
+        decompiled = decompile_packet(packet)
+        apply_controlpacket(house, decompiled, paramqueue)
+        return decompiled
     except Exception as e:
         print(e)
         return None
@@ -72,53 +109,33 @@ def receive_controlpacket() -> Optional[tuple[int, int, dict, int]]:
 house_nr = input("House Nr: ")
 house_data = house_setting[house_nr]
 
-# Configure the oven, according to the house number
-oven_model = house_data["oven"]
-oven_mode = house_data["mode"]
-oven_dict = appliance_data["oven"]
-oven_model_dict = oven_dict[oven_model]
-oven_data = oven_model_dict[oven_mode]
-
-# Configure the dryer, according to the house number
-dryer_dict = appliance_data["dryer"]
-dryer_data = dryer_dict[house_data["dryer"]]
-
-# Configure the heat pumps target temperature, according to house number
-hp_target = house_data["target temperature"]
-
-# Creating a list with all the settings for the house object.
-hd = [house_data["energy rating"], house_data["size"], house_data["height"], \
-      house_data["start temperature"], house_data["start time"], \
-      house_data["active days"]]
-
-# Setting the different coefficients for the appliances.
-oven_coeff = coefficients["oven"]
-dryer_coeff = coefficients["dryer"]
-bg_coeff = coefficients["background"]
-
-# Make Appliances and House (TODO: Make the contants defined somewhere else, controlprotocol maybe?)
-
-# Creating oven appliance for house
-oven = Oven(power_usage=oven_data, power_fluctuation=0.02, controllable=False, state_coeffs=oven_coeff, allowed_cycles=1, cycle_time_range=(30, 120))
-
-# Creating dryer appliance for house
-dryer = Dryer(power_usage=dryer_data, power_fluctuation=0.02, controllable=False, state_coeffs=dryer_coeff, allowed_cycles=1, cycle_time_range=(60,120))
-
-# Creating heat pump appliance for house
-heatpump = Heatpump(1.5, 0, True, heating_multiplier=3, heating_fluctuation=0.05, target_temperature=hp_target)
-
-# Creating the house object.
-house = House(hd[0], hd[1], hd[2], hd[3], hd[4], hd[5], [heatpump, dryer, oven], bg_coeff, 0.01, 0.01)
+# Creating the house object with its appliances
+recorder: Optional[Recorder] = None
+if RECORDFILE is not None:
+    recorder = Recorder(RECORDFILE, {
+        "house_data": house_data,
+        "appliance_data": appliance_data,
+        "coefficients": coefficients
+        })
+    house = recorder.house
+else:
+    house = build_house(house_data, appliance_data, coefficients)
+heatpump = find_heatpump(house)
+
+# Params received by the listener, applied by the runner between ticks
+paramqueue = ParamQueue()
 
 class HouseRunner(Thread):
     def run(self) -> None:
         while True:
             sleep(1)
-            house.update_time(60)
-            devicelist, powerusage, temperature, time = house.tick()
-            devices = 0
-            for i, device in enumerate(devicelist):
-                devices += 2**i if device else 0
+            if recorder is not None:
+                devicelist, powerusage, temperature, time = recorder.tick(60)
+            else:
+                paramqueue.apply(house)
+                house.update_time(60)
+                devicelist, powerusage, temperature, time = house.tick()
+            devices = devices_bitmask(devicelist)
             print(devicelist, devices, powerusage, temperature, time)
             transmit_data("10.10.0.1", 42070, devices, powerusage, temperature, time)
             if STOPTHREADS:
@@ -133,17 +150,8 @@ class CommandListener(Thread):
             if packet == None:
                 continue
             if packet[0] & 8 > 0:
-                lock_flag = not packet[0] & 4 > 0
-                print(lock_flag)
-                heatpump.power_locker(lock_flag)
                 print(heatpump._power_lock)
 
-            # Check if clk flag in packet is set
-            if packet[0] & 1 > 0:
-                if packet[1] > house.time:
-                    # Set house clk to recieved clk in the packet
-                    house.set_time(packet[1])
-
             if STOPTHREADS:
                 break
 
@@ -166,4 +174,8 @@ while True:
         STOPTHREADS = True
         break
 
+if recorder is not None:
+    houserunner.join()
+    recorder.close()
+
 # TODO: Implement the code so it works
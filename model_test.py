@@ -3,6 +3,7 @@
 import models as mod
 import matplotlib.pyplot as plt
 import json
+from plotting import plot_series
 
 with open('coefficients.json', 'r') as fd:
     coefficients = json.load(fd)
@@ -73,11 +74,6 @@ for i in range(minutes):
         temperature_list[i] = temp_temp/days
 
 
-plt.subplot(1,2,1)
-plt.plot(x_list, average)
-plt.title('POWER CONSUMPTION')
-plt.subplot(1,2,2)
-plt.plot(x_list, temperature_list)
-plt.title('TEMPERATURE')
-#plt.plot(x_list,temperature_list)
+# Downsample before plotting, the full series are slow to render
+plot_series(x_list, average, temperature_list)
 plt.show()
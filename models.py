@@ -1,10 +1,91 @@
 # models.py
 
 # Import modules
-from typing import Self, Type, Optional, Union
+from typing import Self, Type, Optional, Union, NamedTuple, Iterator, Callable
+from struct import Struct
+from copy import copy
 from numpy.polynomial.polynomial import polyval
-from numpy.random import default_rng, Generator
-from numpy import linspace
+from numpy.random import default_rng, Generator, SeedSequence, PCG64
+from numpy import linspace, ndarray, arange, asarray, zeros, full, where, \
+        cumsum, concatenate, flatnonzero
+
+# Own modules
+from exogenous import ExogenousProfile, OUTDOOR_TEMPERATURE
+
+
+# Snapshot layouts, the settings control packets can change come last
+RNG_STATE: Struct = Struct('>QQQQ?I')
+APPLIANCE_STATE: Struct = Struct('>??q?I?dq')
+HEATPUMP_STATE: Struct = Struct('>ddd?ddd')
+HOUSE_STATE: Struct = Struct('>dqqdd')
+
+# Adaptive stepping: fewest ticks worth a vectorized step, and most
+# normal ticks between attempts after steps shorter than that
+MIN_QUIET_SLICES: int = 8
+MAX_QUIET_BACKOFF: int = 64
+
+
+def _snapshot_rng(rng: Generator) -> bytes:
+    """Pack the state of a PCG64 randomness generator.
+
+    Args:
+        rng (Generator): The generator
+
+    Returns:
+        bytes: The packed state
+    """
+
+    state = rng.bit_generator.state
+    return RNG_STATE.pack(
+            state['state']['state'] >> 64,
+            state['state']['state'] & 0xFFFFFFFFFFFFFFFF,
+            state['state']['inc'] >> 64,
+            state['state']['inc'] & 0xFFFFFFFFFFFFFFFF,
+            state['has_uint32'] > 0,
+            state['uinteger']
+            )
+
+
+def _restore_rng(rng: Generator, snapshot: bytes, offset: int) -> int:
+    """Unpack the state of a PCG64 randomness generator.
+
+    Args:
+        rng (Generator): The generator to restore into
+        snapshot (bytes): Buffer holding the packed state
+        offset (int): Where the state starts
+
+    Returns:
+        int: Offset after the state
+    """
+
+    state_hi, state_lo, inc_hi, inc_lo, has_uint32, uinteger = \
+            RNG_STATE.unpack_from(snapshot, offset)
+    rng.bit_generator.state = {
+            'bit_generator': 'PCG64',
+            'state': {
+                'state': (state_hi << 64) | state_lo,
+                'inc': (inc_hi << 64) | inc_lo
+                },
+            'has_uint32': int(has_uint32),
+            'uinteger': uinteger
+            }
+
+    return offset + RNG_STATE.size
+
+
+def _fork_rng(rng: Generator) -> Generator:
+    """Make an independent generator continuing from the same state.
+
+    Args:
+        rng (Generator): The generator
+
+    Returns:
+        Generator: The copy
+    """
+
+    fork = Generator(PCG64(0))
+    fork.bit_generator.state = rng.bit_generator.state
+    return fork
 
 
 # Base Model of an Appliance
@@ -20,6 +101,9 @@ class Appliance():
     # Keep track of how many times the appliance has been cycled
     cycle_count: int = 0
 
+    # A cycle start already drawn by House.simulate for the next tick
+    _start_pending: bool = False
+
     def __init__(
             self: Self,
             power_usage: float,
@@ -27,7 +111,8 @@ class Appliance():
             controllable: bool,
             state_coeffs: list[float],
             allowed_cycles: int,
-            cycle_time_range: tuple[int, int]
+            cycle_time_range: tuple[int, int],
+            seed: Optional[Union[int, SeedSequence]] = None
             ) -> None:
         """Initialize the appliance.
 
@@ -39,6 +124,7 @@ class Appliance():
             state_coeffs (list[float]): The coefficients of the state over time polynomial
             allowed_cycles (int): How many times are the appliance allowed to have a cycle in a day (0 and less is infinite)
             cycle_time_range (tuple[int, int]): Range to pick cycle time from (in minutes)
+            seed (Optional[Union[int, SeedSequence]]): Seed for the randomness generator
 
         Returns:
             None:
@@ -53,7 +139,7 @@ class Appliance():
         self._cycle_time_range: tuple[int, int] = cycle_time_range
 
         # Make a randomness generator
-        self._rng: Generator = default_rng()
+        self._rng: Generator = default_rng(seed)
 
     def power_locker(self: Self, lock: bool) -> None:
         """Lock (or unlock) the power on the appliance.
@@ -106,7 +192,13 @@ class Appliance():
         # Sample a probability polynomial
         sample_point: float = time / 3600
 
-        if self._rng.uniform() <= polyval(sample_point, self._state_coeffs):
+        if self._start_pending:
+            self._start_pending = False
+            started: bool = True
+        else:
+            started: bool = self._rng.uniform() <= polyval(sample_point, self._state_coeffs)
+
+        if started:
             self.power_state: bool = True
             self.cycle_count += 1
             self.cycle_end_time: int = time + \
@@ -164,6 +256,61 @@ class Appliance():
 
         self.cycle_count: int = 0
 
+    def snapshot(self: Self) -> bytes:
+        """Pack the state of the appliance, including the randomness generator.
+
+        Args:
+            self (Self): self
+
+        Returns:
+            bytes: The snapshot
+        """
+
+        return APPLIANCE_STATE.pack(
+                self.power_state,
+                self._power_lock,
+                self.cycle_end_time if self.cycle_end_time is not None else 0,
+                self.cycle_end_time is not None,
+                self.cycle_count,
+                self._start_pending,
+                self._power_fluctuation,
+                self._allowed_cycles
+                ) + _snapshot_rng(self._rng)
+
+    def restore(self: Self, snapshot: bytes, offset: int = 0) -> int:
+        """Restore the state of the appliance from a snapshot.
+
+        Args:
+            self (Self): self
+            snapshot (bytes): Buffer holding the snapshot
+            offset (int): Where the snapshot starts
+
+        Returns:
+            int: Offset after the snapshot
+        """
+
+        self.power_state, self._power_lock, cycle_end_time, has_cycle_end, \
+                self.cycle_count, self._start_pending, \
+                self._power_fluctuation, self._allowed_cycles = \
+                APPLIANCE_STATE.unpack_from(snapshot, offset)
+        self.cycle_end_time = cycle_end_time if has_cycle_end else None
+
+        return _restore_rng(self._rng, snapshot, offset + APPLIANCE_STATE.size)
+
+    def fork(self: Self) -> Self:
+        """Make an independent copy of the appliance sharing its configuration.
+
+        Args:
+            self (Self): self
+
+        Returns:
+            Self: The copy
+        """
+
+        fork = copy(self)
+        fork._rng = _fork_rng(self._rng)
+        return fork
+
 
 class Heatpump(Appliance):
 
@@ -174,7 +321,8 @@ class Heatpump(Appliance):
             controllable: bool,
             heating_multiplier: float,
             heating_fluctuation: float,
-            target_temperature: float
+            target_temperature: float,
+            seed: Optional[Union[int, SeedSequence]] = None
             ) -> None:
         """Initialize the heatpump.
 
@@ -186,6 +334,7 @@ class Heatpump(Appliance):
             heating_multiplier (float): How much more does it heat then it uses
             heating_fluctuation (float): Fluctuation of heating in percent
             target_temperature (float): The target temperature
+            seed (Optional[Union[int, SeedSequence]]): Seed for the randomness generator
 
         Returns:
             None:
@@ -205,7 +354,8 @@ class Heatpump(Appliance):
                 controllable,
                 [0],
                 0,
-                (0, 0)
+                (0, 0),
+                seed
                 )
 
     def _calculate_state(self: Self, time: int) -> None:
@@ -280,6 +430,46 @@ class Heatpump(Appliance):
 
         return self.power_state, kw_draw, heating_energy
 
+    def snapshot(self: Self) -> bytes:
+        """Pack the state of the heatpump, including the stabilizer memory.
+
+        Args:
+            self (Self): self
+
+        Returns:
+            bytes: The snapshot
+        """
+
+        return super().snapshot() + HEATPUMP_STATE.pack(
+                self._target_temperature,
+                self._last_heating,
+                self._last_temperature,
+                self._stabilizer_state,
+                self._stabilizer_heating,
+                getattr(self, '_temperature', self._last_temperature),
+                self._heating_fluctuation
+                )
+
+    def restore(self: Self, snapshot: bytes, offset: int = 0) -> int:
+        """Restore the state of the heatpump from a snapshot.
+
+        Args:
+            self (Self): self
+            snapshot (bytes): Buffer holding the snapshot
+            offset (int): Where the snapshot starts
+
+        Returns:
+            int: Offset after the snapshot
+        """
+
+        offset = super().restore(snapshot, offset)
+        self._target_temperature, self._last_heating, self._last_temperature, \
+                self._stabilizer_state, self._stabilizer_heating, \
+                self._temperature, self._heating_fluctuation = \
+                HEATPUMP_STATE.unpack_from(snapshot, offset)
+
+        return offset + HEATPUMP_STATE.size
+
 
 class Dryer(Appliance):
 
@@ -290,7 +480,8 @@ class Dryer(Appliance):
             controllable: bool,
             state_coeffs: list[float],
             allowed_cycles: int,
-            cycle_time_range: tuple[int, int]
+            cycle_time_range: tuple[int, int],
+            seed: Optional[Union[int, SeedSequence]] = None
             ) -> None:
         """Initialize the dryer.
 
@@ -302,6 +493,7 @@ class Dryer(Appliance):
             state_coeffs (list[float]): The coefficients of the state over time polynomial
             allowed_cycles (int): How many times are the appliance allowed to have a cycle in a day (0 and less is infinite)
             cycle_time_range (tuple[int, int]): Range to pick cycle time from (in minutes)
+            seed (Optional[Union[int, SeedSequence]]): Seed for the randomness generator
 
         Returns:
             None:
@@ -314,6 +506,7 @@ class Dryer(Appliance):
                 state_coeffs,
                 allowed_cycles,
                 cycle_time_range,
+                seed
                 )
 
 
@@ -326,7 +519,8 @@ class Oven(Appliance):
             controllable: bool,
             state_coeffs: list[float],
             allowed_cycles: int,
-            cycle_time_range: tuple[int, int]
+            cycle_time_range: tuple[int, int],
+            seed: Optional[Union[int, SeedSequence]] = None
             ) -> None:
         """Initialize the oven.
 
@@ -338,6 +532,7 @@ class Oven(Appliance):
             state_coeffs (list[float]): The coefficients of the state over time polynomial
             allowed_cycles (int): How many times are the appliance allowed to have a cycle in a day (0 and less is infinite)
             cycle_time_range (tuple[int, int]): Range to pick cycle time from (in minutes)
+            seed (Optional[Union[int, SeedSequence]]): Seed for the randomness generator
 
         Returns:
             None:
@@ -350,9 +545,21 @@ class Oven(Appliance):
                 state_coeffs,
                 allowed_cycles,
                 cycle_time_range,
+                seed
                 )
 
 
+class Forecast(NamedTuple):
+    """Predicted trajectories of what-if branches.
+
+    power and temperature have one row per branch and one column per time.
+    """
+
+    times: ndarray
+    power: ndarray
+    temperature: ndarray
+
+
 # Model of a Household
 class House():
     """Model of a household.
@@ -378,10 +585,17 @@ class House():
             appliances: list[Type[Appliance]],
             bg_power_coeffs: list[float],
             bg_power_fluctuation: float,
-            random_heat_loss_chance: float
+            random_heat_loss_chance: float,
+            seed: Optional[Union[int, SeedSequence]] = None,
+            exogenous: Optional[ExogenousProfile] = None
             ) -> None:
         """Initialize Household.
 
+        With an outdoor temperature in the exogenous profile the heat loss
+        follows the difference to the outdoor temperature, scaled so the
+        mean outdoor temperature of the profile and the start temperature
+        give the yearly loss of the energy label.
+
         Args:
             self (Self): self
             energy_label (str): The energy label of the house
@@ -395,6 +609,8 @@ class House():
             bg_power_fluctuation (float): Fluctuation in background power usage (in percent)
             random_heat_loss_chance (float): Decimal percentage chance of \
             random loss of heat, due to external influences
+            seed (Optional[Union[int, SeedSequence]]): Seed for the randomness generator
+            exogenous (Optional[ExogenousProfile]): External inputs, e.g. outdoor temperature and tariff
 
         Returns:
             None:
@@ -409,6 +625,17 @@ class House():
         self._bg_power_coeffs: list[float] = bg_power_coeffs
         self._bg_power_fluctuation: float = bg_power_fluctuation
         self._random_heat_loss_chance: float = random_heat_loss_chance
+        self._exogenous: Optional[ExogenousProfile] = exogenous
+
+        # Called with the house after every tick
+        self._listeners: list[Callable[[Self], None]] = []
+
+        # Indoor to outdoor difference the yearly loss is calculated for
+        self._loss_delta: Optional[float] = None
+        if exogenous is not None and OUTDOOR_TEMPERATURE in exogenous:
+            self._loss_delta = start_temperature - exogenous.mean(OUTDOOR_TEMPERATURE)
+            if self._loss_delta <= 0:
+                raise ValueError("Mean outdoor temperature must be below the start temperature")
 
         # Set temperature
         self.current_temperature: float = start_temperature
@@ -426,7 +653,7 @@ class House():
         self._kg_air: float = self.cubic_meters * 1.219
 
         # Make randomness generator
-        self._rng = default_rng()
+        self._rng = default_rng(seed)
 
         # Make sure that the energy_label exists
         if not self.LIMIT_VALUES.get(self.energy_label, None):
@@ -448,15 +675,27 @@ class House():
 
         return kj/(1.005 * self._kg_air)
 
-    def _calculate_heat_loss(self: Self, minutes: float) -> float:
+    def _calculate_heat_loss(
+            self: Self,
+            minutes: float,
+            temperature: Union[float, ndarray],
+            start: int,
+            end: int
+            ) -> Union[float, ndarray]:
         """Calculate the total heatloss in the given minute interval.
 
+        With an outdoor temperature the loss is scaled by the difference
+        between the indoor and the mean outdoor temperature of the interval.
+
         Args:
             self (Self): self
             minutes (int): Minutes to calculate loss for.
+            temperature (Union[float, ndarray]): Indoor temperature at the start of the interval
+            start (int): Unix time the interval starts
+            end (int): Unix time the interval ends
 
         Returns:
-            float: Loss in celsius.
+            Union[float, ndarray]: Loss in celsius.
         """
 
         # Calculate the yearly loss in kwh
@@ -472,8 +711,65 @@ class House():
         # Calculate celsius change
         celsius_minute_loss: float = self._kj2celsius(kj_minute_loss)
 
-        # Return the celsius scaled to the minutes
-        return celsius_minute_loss * minutes
+        # Scale the celsius to the minutes and the outdoor temperature
+        heat_loss: float = celsius_minute_loss * minutes
+        outdoor: Optional[float] = self._outdoor_temperature(start, end)
+        if outdoor is None:
+            return heat_loss
+
+        return heat_loss * ((temperature - outdoor) / self._loss_delta)
+
+    def _outdoor_temperature(
+            self: Self,
+            start: Union[int, ndarray],
+            end: Union[int, ndarray]
+            ) -> Optional[Union[float, ndarray]]:
+        """Get the mean outdoor temperature over intervals.
+
+        Args:
+            self (Self): self
+            start (Union[int, ndarray]): Unix time the intervals start
+            end (Union[int, ndarray]): Unix time the intervals end
+
+        Returns:
+            Optional[Union[float, ndarray]]: Outdoor temperature, None without a profile for it
+        """
+
+        if self._loss_delta is None:
+            return None
+
+        return self._exogenous.average(OUTDOOR_TEMPERATURE, start, end)
+
+    def exogenous_input(self: Self, channel: str) -> Optional[float]:
+        """Get an external input at the current time, e.g. the tariff.
+
+        Args:
+            self (Self): self
+            channel (str): Name of the channel in the exogenous profile
+
+        Returns:
+            Optional[float]: The value, None if the house has no such input
+        """
+
+        if self._exogenous is None or channel not in self._exogenous:
+            return None
+
+        return self._exogenous.value(channel, self.time)
+
+    def add_listener(self: Self, listener: Callable[[Self], None]) -> None:
+        """Call a function with the house after every tick.
+
+        Listeners are not copied to forks.
+
+        Args:
+            self (Self): self
+            listener (Callable[[Self], None]): The function
+
+        Returns:
+            None:
+        """
+
+        self._listeners.append(listener)
 
     def _calculate_heat_gain(self: Self, kj: float) -> float:
         """Calculate the gained celsius by the given kj.
@@ -557,9 +853,16 @@ class House():
             total_kw_draw += kw_draw
             total_heating_kj += heating_kj
 
+        heat_loss: float = self._calculate_heat_loss(
+                minutes,
+                self.current_temperature,
+                self.last_tick,
+                self.time
+                )
+
         # Calculate the new temperature
         self.current_temperature += self._calculate_heat_gain(total_heating_kj) - \
-            self._calculate_heat_loss(minutes)
+            heat_loss
         # Add random heat loss from open doors ect.
         if self._rng.uniform(0, 1) < self._random_heat_loss_chance:
             self.current_temperature -= self._rng.uniform(0, 1)
@@ -613,5 +916,604 @@ class House():
         # Update the last_tick date
         self.last_tick: int = self.time
 
+        for listener in self._listeners:
+            listener(self)
+
         return power_states, total_kw_draw, self.current_temperature, self.time
 
+    def _quiet_slices(
+            self: Self,
+            max_slices: int,
+            resolution: int,
+            tolerance: float
+            ) -> tuple[int, list[Appliance]]:
+        """Count the coming ticks where no appliance can change its state.
+
+        An appliance in a cycle is quiet until the cycle ends. For an
+        appliance that may start a cycle the start chances of the coming
+        ticks are drawn at once, it is quiet until the first start. The
+        heatpump is limited later on, when the temperatures are known, but
+        nothing is drawn when its nominal rate reaches the stabilizer band
+        within MIN_QUIET_SLICES ticks.
+
+        Args:
+            self (Self): self
+            max_slices (int): Upper bound on the ticks
+            resolution (int): Seconds per tick
+            tolerance (float): Start chances per tick below this are ignored
+
+        Returns:
+            tuple[int, list[Appliance]]: Number of quiet ticks, appliances starting in the tick after them
+        """
+
+        for appliance in self._appliances:
+            # A start is already drawn for the next tick
+            if appliance._start_pending:
+                return 0, []
+
+            # The heatpump changes every tick in its stabilizer band, and
+            # a step is not worth it when the band is only a few ticks away
+            if type(appliance) == Heatpump and not appliance._power_lock and (
+                    appliance._target_temperature * 0.998 < self.current_temperature < \
+                    appliance._target_temperature * 1.025 or \
+                    self._ticks_to_band(appliance, resolution) < MIN_QUIET_SLICES
+                    ):
+                return 0, []
+
+            # Appliances with their own tick are always stepped normally
+            if type(appliance) != Heatpump and type(appliance).tick is not Appliance.tick:
+                return 0, []
+
+        # Midnight resets the appliances, that tick is done normally
+        next_midnight: int = (self.time // 86400 + 1) * 86400
+        slices: int = min(max_slices, (next_midnight - 1 - self.time) // resolution)
+        sampling: list[Appliance] = []
+
+        for appliance in self._appliances:
+            if type(appliance) == Heatpump:
+                continue
+
+            # In a cycle until the tick reaching the end of the cycle
+            if appliance.cycle_end_time is not None and \
+                    self.time + resolution < appliance.cycle_end_time:
+                slices = min(slices, -(-(appliance.cycle_end_time - self.time) // resolution) - 1)
+                continue
+
+            # No more cycles allowed today
+            if appliance._allowed_cycles <= appliance.cycle_count and \
+                    not appliance._allowed_cycles <= 0:
+                continue
+
+            sampling.append(appliance)
+
+        if slices < MIN_QUIET_SLICES:
+            return 0, []
+
+        # Draw the starts of the coming ticks, like _calculate_state does
+        times: ndarray = self.time + resolution * arange(1, slices + 1)
+        first_starts: list[Optional[int]] = []
+        for appliance in sampling:
+            chance: ndarray = polyval(times / 3600, appliance._state_coeffs)
+            started: ndarray = (appliance._rng.uniform(size=slices) <= chance) & \
+                    (chance >= tolerance)
+            first_starts.append(int(started.argmax()) if started.any() else None)
+
+        slices = min([slices] + [first for first in first_starts if first is not None])
+        starting: list[Appliance] = [
+                appliance for appliance, first_start in zip(sampling, first_starts)
+                if first_start == slices
+                ]
+
+        return slices, starting
+
+    def _ticks_to_band(self: Self, heatpump: Heatpump, resolution: int) -> float:
+        """Estimate the ticks until an unlocked heatpump enters its stabilizer band.
+
+        Uses the nominal heating and loss, without fluctuations, so it only
+        decides whether a step is worth trying.
+
+        Args:
+            self (Self): self
+            heatpump (Heatpump): The heatpump of the house
+            resolution (int): Seconds per tick
+
+        Returns:
+            float: Estimated ticks, 0 in the band and inf when it is never reached
+        """
+
+        target: float = heatpump._target_temperature
+        heat_loss: float = self._calculate_heat_loss(
+                resolution / 60,
+                self.current_temperature,
+                self.time,
+                self.time + resolution
+                )
+
+        # Heating below the band
+        if self.current_temperature <= target * 0.998:
+            rate: float = self._calculate_heat_gain(
+                    heatpump._power_usage * resolution * heatpump._heating_multiplier
+                    ) - heat_loss
+            distance: float = target * 0.998 - self.current_temperature
+
+        # Cooling above the band, random losses included on average
+        elif self.current_temperature >= target * 1.025:
+            rate = heat_loss + self._random_heat_loss_chance / 2
+            distance = self.current_temperature - target * 1.025
+
+        else:
+            return 0.0
+
+        return distance / rate if rate > 0 else float('inf')
+
+    def _advance_quiet(
+            self: Self,
+            slices: int,
+            resolution: int
+            ) -> list[tuple[list[bool], float, float, int]]:
+        """Advance the house over quiet ticks in one vectorized step.
+
+        Every tick keeps its own random fluctuations, background power and
+        random heat loss. The step ends early where the temperature would
+        change the state of the heatpump.
+
+        Args:
+            self (Self): self
+            slices (int): Number of quiet ticks from _quiet_slices
+            resolution (int): Seconds per tick
+
+        Returns:
+            list[tuple[list[bool], float, float, int]]: The result of every tick, like tick
+        """
+
+        times: ndarray = self.time + resolution * arange(1, slices + 1)
+        total_kw_draw: ndarray = zeros(slices)
+        heating_kj: ndarray = zeros(slices)
+        power_states: list = []
+        heatpump: Optional[Heatpump] = None
+
+        # Decide the states first, nothing is drawn if the step is not possible
+        for appliance in self._appliances:
+            if type(appliance) == Heatpump:
+                heatpump = appliance
+                target: float = heatpump._target_temperature
+
+                # Heating below the stabilizer band, off above it
+                if heatpump._power_lock:
+                    on: bool = heatpump.power_state
+                elif self.current_temperature <= target * 0.998:
+                    on = True
+                elif self.current_temperature >= target * 1.025:
+                    on = False
+                else:
+                    return []
+            else:
+                on = appliance.cycle_end_time is not None and \
+                        self.time + resolution < appliance.cycle_end_time and \
+                        (appliance.power_state or not appliance._power_lock)
+
+            power_states.append(on)
+
+        for appliance, on in zip(self._appliances, power_states):
+            if not on:
+                continue
+
+            kw_draw: ndarray = appliance._power_usage * \
+                    (1 + appliance._rng.uniform(
+                        -appliance._power_fluctuation,
+                        appliance._power_fluctuation,
+                        slices
+                        )
+                    )
+            total_kw_draw += kw_draw
+
+            if appliance is heatpump:
+                heating_kj = kw_draw * resolution * \
+                        heatpump._heating_multiplier * \
+                        (1 + heatpump._rng.uniform(
+                            -heatpump._heating_fluctuation,
+                            heatpump._heating_fluctuation,
+                            slices
+                            )
+                        )
+
+        # Temperature before and after every tick
+        random_loss: ndarray = where(
+                self._rng.uniform(0, 1, slices) < self._random_heat_loss_chance,
+                self._rng.uniform(0, 1, slices),
+                0.0
+                )
+        if self._loss_delta is None:
+            # The loss is the same every tick
+            heat_loss: float = self._calculate_heat_loss(
+                    resolution / 60,
+                    self.current_temperature,
+                    self.time,
+                    self.time + resolution
+                    )
+            temperatures: ndarray = self.current_temperature + cumsum(
+                    self._calculate_heat_gain(heating_kj) - \
+                    heat_loss - \
+                    random_loss
+                    )
+        else:
+            # The loss depends on the temperature, run the recurrence like
+            # tick does so the rounding matches (a closed form drifts)
+            temperature: float = self.current_temperature
+            stepped: list[float] = []
+            for time, gain, loss in zip(
+                    times.tolist(),
+                    self._calculate_heat_gain(heating_kj).tolist(),
+                    random_loss.tolist()
+                    ):
+                temperature += gain - \
+                        self._calculate_heat_loss(resolution / 60, temperature, time - resolution, time)
+                temperature -= loss
+                stepped.append(temperature)
+            temperatures = asarray(stepped)
+        temperatures_before: ndarray = concatenate(([self.current_temperature], temperatures[:-1]))
+
+        # Stop where the heatpump would change state
+        if heatpump is not None and not heatpump._power_lock:
+            if power_states[self._appliances.index(heatpump)]:
+                changed: ndarray = temperatures_before > heatpump._target_temperature * 0.998
+            else:
+                changed = temperatures_before < heatpump._target_temperature * 1.025
+
+            if changed.any():
+                slices = int(changed.argmax())
+                times = times[:slices]
+                total_kw_draw = total_kw_draw[:slices]
+                temperatures = temperatures[:slices]
+                temperatures_before = temperatures_before[:slices]
+
+        # Background power, sampled every second like tick
+        sample_points: ndarray = linspace(
+                ((times - resolution) / 3600) % 24,
+                (times / 3600) % 24,
+                resolution,
+                axis=1
+                )
+        total_kw_draw = total_kw_draw + polyval(sample_points, self._bg_power_coeffs).mean(axis=1) * \
+                (1 + self._rng.uniform(
+                    -self._bg_power_fluctuation,
+                    self._bg_power_fluctuation,
+                    slices
+                    )
+                )
+
+        # Leave the heatpump as the last tick would have
+        if heatpump is not None:
+            last_temperatures: ndarray = concatenate(([heatpump._last_temperature], temperatures_before[:-1]))
+            target = heatpump._target_temperature
+            checked: ndarray = temperatures_before > target * 0.99
+            band: ndarray = (target * 0.998 < temperatures_before) & \
+                    (temperatures_before < target * 1.025) & \
+                    (last_temperatures < target * 1.01)
+
+            if checked.any():
+                heatpump._stabilizer_state = bool(band[flatnonzero(checked)[-1]])
+
+            if band.any():
+                last: int = flatnonzero(band)[-1]
+                if last_temperatures[last] < temperatures_before[last]:
+                    heatpump._stabilizer_heating = 0.965 * heatpump._last_heating
+                elif last_temperatures[last] > temperatures_before[last]:
+                    heatpump._stabilizer_heating = 1.035 * heatpump._last_heating
+
+            heatpump.power_state = power_states[self._appliances.index(heatpump)]
+            heatpump._temperature = float(temperatures_before[-1])
+            heatpump._last_temperature = float(temperatures_before[-1])
+
+        for appliance, on in zip(self._appliances, power_states):
+            if appliance is not heatpump:
+                appliance.power_state = on
+
+        self.current_temperature = float(temperatures[-1])
+        self.time = int(times[-1])
+        self.last_tick = self.time
+
+        for listener in self._listeners:
+            listener(self)
+
+        return [
+                (list(power_states), kw_draw, temperature, time)
+                for kw_draw, temperature, time in zip(
+                    total_kw_draw.tolist(),
+                    temperatures.tolist(),
+                    times.tolist()
+                    )
+                ]
+
+    def simulate(
+            self: Self,
+            end_time: int,
+            resolution: int = 60,
+            tolerance: float = 0.0
+            ) -> Iterator[tuple[list[bool], float, float, int]]:
+        """Run the house until the end time with adaptive steps.
+
+        Stretches where nothing discrete can change (no cycle ending or
+        likely to start, the heatpump away from its stabilizer band, no
+        midnight reset) are advanced in one vectorized step, everything
+        else is ticked normally. The result of every tick is still reported
+        at the given resolution. With a tolerance of 0 the results have the
+        same distribution as ticking normally.
+
+        Args:
+            self (Self): self
+            end_time (int): Unix time to run until
+            resolution (int): Seconds per reported tick
+            tolerance (float): Cycle start chances per tick below this are ignored
+
+        Returns:
+            Iterator[tuple[list[bool], float, float, int]]: The result of every tick, like tick
+        """
+
+        # Catch up on time set before simulating
+        if self.time != self.last_tick:
+            yield self.tick()
+
+        # Look ahead further while the steps use all of it, so short quiet
+        # stretches do not draw a whole day of starts
+        window: int = 16
+
+        # Normal ticks left before trying a step again, and the next backoff
+        skip: int = 0
+        backoff: int = MIN_QUIET_SLICES
+
+        while self.time + resolution <= end_time:
+            if skip > 0:
+                skip -= 1
+                self.update_time(resolution)
+                yield self.tick()
+                continue
+
+            slices, starting = self._quiet_slices(
+                    min(window, (end_time - self.time) // resolution),
+                    resolution,
+                    tolerance
+                    )
+
+            if slices == 0:
+                self.update_time(resolution)
+                yield self.tick()
+                continue
+
+            results = self._advance_quiet(slices, resolution)
+            yield from results
+
+            # The drawn starts happen in the next tick, unless the step ended early
+            if len(results) == slices:
+                for appliance in starting:
+                    appliance._start_pending = True
+
+            window = min(window * 2, 86400 // resolution) if len(results) == window else 16
+
+            # Back off after steps too short to pay for themselves
+            if len(results) < MIN_QUIET_SLICES:
+                skip = backoff
+                backoff = min(backoff * 2, MAX_QUIET_BACKOFF)
+            else:
+                backoff = MIN_QUIET_SLICES
+
+            if not results:
+                self.update_time(resolution)
+                yield self.tick()
+
+    def snapshot(self: Self) -> bytes:
+        """Pack the state of the house and all its appliances.
+
+        Of the configuration only the settings control packets can change
+        are included, a snapshot can only be restored into a house built
+        the same way.
+
+        Args:
+            self (Self): self
+
+        Returns:
+            bytes: The snapshot
+        """
+
+        return b''.join([
+            HOUSE_STATE.pack(
+                self.current_temperature,
+                self.time,
+                self.last_tick,
+                self._bg_power_fluctuation,
+                self._random_heat_loss_chance
+                ),
+            _snapshot_rng(self._rng),
+            *(appliance.snapshot() for appliance in self._appliances)
+            ])
+
+    def restore(self: Self, snapshot: bytes, offset: int = 0) -> int:
+        """Restore the state of the house and all its appliances.
+
+        Args:
+            self (Self): self
+            snapshot (bytes): Buffer holding the snapshot
+            offset (int): Where the snapshot starts
+
+        Returns:
+            int: Offset after the snapshot
+        """
+
+        self.current_temperature, self.time, self.last_tick, \
+                self._bg_power_fluctuation, self._random_heat_loss_chance = \
+                HOUSE_STATE.unpack_from(snapshot, offset)
+        offset = _restore_rng(self._rng, snapshot, offset + HOUSE_STATE.size)
+
+        for appliance in self._appliances:
+            offset = appliance.restore(snapshot, offset)
+
+        return offset
+
+    def fork(self: Self, into: Optional[Self] = None) -> Self:
+        """Fork the house into an independent scenario.
+
+        The configuration is shared with the fork. Forking into an earlier
+        fork only copies the state, which is the cheap way to reset branches.
+
+        Args:
+            self (Self): self
+            into (Optional[Self]): Earlier fork to overwrite
+
+        Returns:
+            Self: The fork
+        """
+
+        if into is not None:
+            into.restore(self.snapshot())
+            return into
+
+        fork = copy(self)
+        fork._rng = _fork_rng(self._rng)
+        fork._appliances = [appliance.fork() for appliance in self._appliances]
+        fork._listeners = []
+        return fork
+
+    def _reseed(self: Self, seed: SeedSequence) -> None:
+        """Give the house and its appliances new generators.
+
+        Args:
+            self (Self): self
+            seed (SeedSequence): Seed to spawn the generators from
+
+        Returns:
+            None:
+        """
+
+        house_seed, *appliance_seeds = seed.spawn(1 + len(self._appliances))
+        self._rng = default_rng(house_seed)
+        for appliance, appliance_seed in zip(self._appliances, appliance_seeds):
+            appliance._rng = default_rng(appliance_seed)
+
+    def what_if(
+            self: Self,
+            lock_durations: list[int],
+            horizon: int = 86400,
+            step: int = 60,
+            vectorized: bool = True,
+            seed: Optional[Union[int, SeedSequence]] = None
+            ) -> Forecast:
+        """Forecast branches where the heatpump is locked for a while.
+
+        Every branch locks the heatpump from now for its duration and then
+        unlocks it, a duration of 0 unlocks it right away. The house itself
+        is not changed.
+
+        The vectorized forecast evaluates all branches at once with the
+        expected values of the random parts, only cycles already running
+        count for the other appliances. Otherwise every branch is a fork
+        ticked ahead with its own generators spawned from the seed, giving
+        one independent random sample per branch.
+
+        Args:
+            self (Self): self
+            lock_durations (list[int]): Seconds to lock the heatpump, one per branch
+            horizon (int): Seconds to look ahead
+            step (int): Seconds per step
+            vectorized (bool): Use the vectorized forecast
+            seed (Optional[Union[int, SeedSequence]]): Seed of the branches, fresh randomness if None
+
+        Returns:
+            Forecast: Times, kW draw and temperature per branch
+        """
+
+        heatpump: Optional[Heatpump] = None
+        for appliance in self._appliances:
+            if type(appliance) == Heatpump:
+                heatpump = appliance
+                break
+
+        if heatpump is None:
+            raise ValueError("House has no heatpump")
+
+        times: ndarray = self.time + step * arange(1, horizon // step + 1)
+        lock_until: ndarray = self.time + asarray(lock_durations)
+
+        if not vectorized:
+            power: ndarray = zeros((len(lock_until), len(times)))
+            temperature: ndarray = zeros((len(lock_until), len(times)))
+            fork: Optional[Self] = None
+
+            if not isinstance(seed, SeedSequence):
+                seed = SeedSequence(seed)
+            branch_seeds: list[SeedSequence] = seed.spawn(len(lock_until))
+
+            for branch, until in enumerate(lock_until):
+                fork = self.fork(fork)
+                fork._reseed(branch_seeds[branch])
+                fork_heatpump: Heatpump = fork._appliances[self._appliances.index(heatpump)]
+                fork_heatpump.power_locker(bool(until > self.time))
+
+                for i, time in enumerate(times):
+                    if fork_heatpump._power_lock and time > until:
+                        fork_heatpump.power_locker(False)
+                    fork.set_time(int(time))
+                    _, power[branch, i], temperature[branch, i], _ = fork.tick()
+
+            return Forecast(times, power, temperature)
+
+        # The load of the other appliances and background is the same in every branch
+        base_power: ndarray = zeros(len(times))
+        for appliance in self._appliances:
+            if appliance is not heatpump and appliance.power_state and \
+                    appliance.cycle_end_time is not None:
+                base_power += where(times < appliance.cycle_end_time, appliance._power_usage, 0.0)
+
+        sample_points: ndarray = ((times[:, None] - step + \
+                linspace(0, step, step)[None, :]) / 3600) % 24
+        base_power += polyval(sample_points, self._bg_power_coeffs).mean(axis=1)
+
+        # Temperature change apart from the heatpump
+        random_loss: float = self._random_heat_loss_chance * 0.5
+        heating_celsius: float = self._kj2celsius(step * heatpump._heating_multiplier)
+
+        # Heatpump state per branch
+        target: float = heatpump._target_temperature
+        temperature_now: ndarray = full(len(lock_until), self.current_temperature)
+        last_temperature: ndarray = full(len(lock_until), float(heatpump._last_temperature))
+        last_heating: ndarray = full(len(lock_until), float(heatpump._last_heating))
+        stabilizer_heating: ndarray = full(len(lock_until), float(heatpump._stabilizer_heating))
+
+        # Rows are times while stepping, transposed to branches at the end
+        unlocked_at: ndarray = times[:, None] > lock_until[None, :]
+        power: ndarray = zeros((len(times), len(lock_until)))
+        temperature: ndarray = zeros((len(times), len(lock_until)))
+
+        for i, unlocked in enumerate(unlocked_at):
+            # Locking turns it off, otherwise it heats below the target
+            kw_draw: ndarray = heatpump._power_usage * \
+                    (unlocked & (temperature_now < target))
+
+            # Temperature stabilization (the 0.99 check is implied by the band)
+            stabilizer: ndarray = (target * 0.998 < temperature_now) & \
+                    (temperature_now < target * 1.025) & \
+                    (last_temperature < target * 1.01)
+            stabilizer_heating = where(
+                    stabilizer & (last_temperature != temperature_now),
+                    where(last_temperature < temperature_now, 0.965, 1.035) * last_heating,
+                    stabilizer_heating
+                    )
+            stabilized: ndarray = stabilizer & unlocked
+            kw_draw = where(stabilized, stabilizer_heating, kw_draw)
+            last_heating = where(stabilized, kw_draw, last_heating)
+
+            loss: Union[float, ndarray] = random_loss + self._calculate_heat_loss(
+                    step / 60,
+                    temperature_now,
+                    int(times[i]) - step,
+                    int(times[i])
+                    )
+
+            last_temperature = temperature_now
+            temperature_now = temperature_now + kw_draw * heating_celsius - loss
+
+            power[i] = kw_draw
+            temperature[i] = temperature_now
+
+        power += base_power[:, None]
+
+        return Forecast(times, power.T, temperature.T)
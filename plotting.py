@@ -0,0 +1,275 @@
+# plotting.py
+
+# Import Modules
+from typing import Optional, Iterable
+
+import numpy as np
+import matplotlib.pyplot as plt
+
+
+def minmax_downsample(
+        x: np.ndarray,
+        y: np.ndarray,
+        buckets: int
+        ) -> tuple[np.ndarray, np.ndarray]:
+    """Downsample a series to the minimum and maximum of every bucket.
+
+    Peaks survive the downsampling, so the plotted shape is the same as
+    plotting all the points.
+
+    Args:
+        x (np.ndarray): x values, increasing
+        y (np.ndarray): y values
+        buckets (int): Number of buckets (the result has twice as many points)
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: Downsampled x and y
+    """
+
+    x = np.asarray(x)
+    y = np.asarray(y)
+    if len(y) <= 2 * buckets:
+        return x, y
+
+    # Pad with the last value so every bucket has the same size
+    size = -(-len(y) // buckets)
+    padded = np.pad(y, (0, size * buckets - len(y)), mode='edge').reshape(buckets, size)
+
+    offsets = np.arange(buckets) * size
+    low = offsets + padded.argmin(axis=1)
+    high = offsets + padded.argmax(axis=1)
+
+    # Keep the points of a bucket in their original order
+    indices = np.minimum(np.sort(np.stack([low, high], axis=1), axis=1).ravel(), len(y) - 1)
+    return x[indices], y[indices]
+
+
+def lttb(x: np.ndarray, y: np.ndarray, points: int) -> tuple[np.ndarray, np.ndarray]:
+    """Downsample a series with largest triangle three buckets.
+
+    Args:
+        x (np.ndarray): x values, increasing
+        y (np.ndarray): y values
+        points (int): Number of points to keep
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: Downsampled x and y
+    """
+
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    if len(y) <= points or points < 3:
+        return x, y
+
+    # The first and last points are always kept, the rest is split in buckets
+    edges = np.linspace(1, len(y) - 1, points - 1).astype(np.int64)
+    indices = np.empty(points, dtype=np.int64)
+    indices[0] = 0
+    indices[-1] = len(y) - 1
+
+    for i in range(points - 2):
+        start, end = edges[i], edges[i+1]
+
+        # Average of the next bucket, the last point for the last bucket
+        if i + 2 < len(edges):
+            next_x = x[end:edges[i+2]].mean()
+            next_y = y[end:edges[i+2]].mean()
+        else:
+            next_x = x[-1]
+            next_y = y[-1]
+
+        previous = indices[i]
+        areas = np.abs(
+                (x[previous] - next_x) * (y[start:end] - y[previous]) - \
+                (x[previous] - x[start:end]) * (next_y - y[previous])
+                )
+        indices[i+1] = start + areas.argmax()
+
+    return x[indices], y[indices]
+
+
+def decimate(
+        x: np.ndarray,
+        y: np.ndarray,
+        points: int = 4000,
+        method: str = 'minmax'
+        ) -> tuple[np.ndarray, np.ndarray]:
+    """Downsample a series for plotting.
+
+    Args:
+        x (np.ndarray): x values, increasing
+        y (np.ndarray): y values
+        points (int): About how many points to keep
+        method (str): 'minmax' or 'lttb'
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: Downsampled x and y
+    """
+
+    match method:
+
+        case 'minmax':
+            return minmax_downsample(x, y, points // 2)
+
+        case 'lttb':
+            return lttb(x, y, points)
+
+        case _:
+            raise ValueError('Invalid downsampling method')
+
+
+def _distinct(values: np.ndarray) -> np.ndarray:
+    """Get the sorted distinct values, by sorting (np.unique hashes, slower here).
+
+    Args:
+        values (np.ndarray): The values
+
+    Returns:
+        np.ndarray: Sorted distinct values
+    """
+
+    values = np.sort(values)
+    if len(values) == 0:
+        return values
+
+    return values[np.concatenate(([True], values[1:] != values[:-1]))]
+
+
+def overview_from_chunks(
+        chunks: Iterable[dict[str, np.ndarray]],
+        start: int,
+        end: int,
+        bins: int = 2000
+        ) -> dict[str, np.ndarray]:
+    """Reduce exported tick results to a fleet overview per time bin.
+
+    The chunks are consumed one by one, so the whole run never has to be in
+    memory at once, only the distinct tick times are kept. The fleet power
+    is the summed power per tick averaged over the ticks in the bin, the
+    rows may be in any order (e.g. written house by house).
+
+    Args:
+        chunks (Iterable[dict[str, np.ndarray]]): Columns per chunk, e.g. TimeseriesReader.chunks
+        start (int): First time of the overview
+        end (int): Time to end the overview before
+        bins (int): Number of time bins
+
+    Returns:
+        dict[str, np.ndarray]: Bin times, fleet power and per house power/temperature envelopes
+    """
+
+    width = (end - start) / bins
+    rows = np.zeros(bins)
+    power_sum = np.zeros(bins)
+    power_min = np.full(bins, np.inf)
+    power_max = np.full(bins, -np.inf)
+    temperature_sum = np.zeros(bins)
+    temperature_min = np.full(bins, np.inf)
+    temperature_max = np.full(bins, -np.inf)
+    # Distinct tick times per chunk, merged when they pile up
+    tick_times: list[np.ndarray] = []
+    pending = 0
+    distinct = 0
+
+    for columns in chunks:
+        mask = (columns['time'] >= start) & (columns['time'] < end)
+        time = columns['time'][mask]
+        index = ((time - start) / width).astype(np.int64)
+        power = columns['power'][mask]
+        temperature = columns['temperature'][mask]
+
+        rows += np.bincount(index, minlength=bins)
+        power_sum += np.bincount(index, power, minlength=bins)
+        temperature_sum += np.bincount(index, temperature, minlength=bins)
+
+        # Count every tick once, whichever chunks its rows are in
+        tick_times.append(_distinct(time))
+        pending += len(tick_times[-1])
+        if pending > 4 * distinct + 2**20:
+            tick_times = [_distinct(np.concatenate(tick_times))]
+            distinct = pending = len(tick_times[0])
+
+        if len(index) == 0:
+            continue
+
+        # Reduce the sorted bins in one pass
+        order = np.argsort(index, kind='stable')
+        index = index[order]
+        starts = np.flatnonzero(np.diff(index, prepend=-1))
+        used = index[starts]
+        power_min[used] = np.minimum(power_min[used], np.minimum.reduceat(power[order], starts))
+        power_max[used] = np.maximum(power_max[used], np.maximum.reduceat(power[order], starts))
+        temperature_min[used] = np.minimum(temperature_min[used], np.minimum.reduceat(temperature[order], starts))
+        temperature_max[used] = np.maximum(temperature_max[used], np.maximum.reduceat(temperature[order], starts))
+
+    tick_times = _distinct(np.concatenate(tick_times)) if tick_times else np.empty(0, dtype=np.int64)
+    ticks = np.bincount(((tick_times - start) / width).astype(np.int64), minlength=bins)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        fleet_power = power_sum / ticks
+        temperature_mean = temperature_sum / rows
+
+    return {
+            'time': start + (np.arange(bins) + 0.5) * width,
+            'fleet_power': fleet_power,
+            'power_min': np.where(rows > 0, power_min, np.nan),
+            'power_max': np.where(rows > 0, power_max, np.nan),
+            'temperature_mean': temperature_mean,
+            'temperature_min': np.where(rows > 0, temperature_min, np.nan),
+            'temperature_max': np.where(rows > 0, temperature_max, np.nan)
+            }
+
+
+def plot_series(
+        x: np.ndarray,
+        power: np.ndarray,
+        temperature: np.ndarray,
+        points: int = 4000,
+        method: str = 'minmax'
+        ) -> None:
+    """Plot power consumption and temperature side by side, downsampled.
+
+    Args:
+        x (np.ndarray): x values
+        power (np.ndarray): Power consumption
+        temperature (np.ndarray): Temperature
+        points (int): About how many points to plot per series
+        method (str): 'minmax' or 'lttb'
+
+    Returns:
+        None:
+    """
+
+    plt.subplot(1,2,1)
+    plt.plot(*decimate(x, power, points, method))
+    plt.title('POWER CONSUMPTION')
+    plt.subplot(1,2,2)
+    plt.plot(*decimate(x, temperature, points, method))
+    plt.title('TEMPERATURE')
+
+
+def plot_overview(overview: dict[str, np.ndarray], path: Optional[str] = None) -> None:
+    """Plot a fleet overview made by overview_from_chunks.
+
+    Args:
+        overview (dict[str, np.ndarray]): The overview
+        path (Optional[str]): Save the figure here instead of showing it
+
+    Returns:
+        None:
+    """
+
+    hours = overview['time'] / 3600
+
+    plt.subplot(1,2,1)
+    plt.plot(hours, overview['fleet_power'])
+    plt.title('FLEET POWER CONSUMPTION')
+    plt.subplot(1,2,2)
+    plt.fill_between(hours, overview['temperature_min'], overview['temperature_max'], alpha=0.3)
+    plt.plot(hours, overview['temperature_mean'])
+    plt.title('TEMPERATURE')
+
+    if path is not None:
+        plt.savefig(path)
+    else:
+        plt.show()
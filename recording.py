@@ -0,0 +1,267 @@
+# recording.py
+
+# Import Modules
+from typing import Optional, BinaryIO
+from threading import Lock
+import struct
+import json
+import mmap
+
+from numpy.random import SeedSequence
+
+# Own modules
+from communication_utils import decompile_packet
+from house_utils import build_house, apply_controlpacket
+from models import House
+
+
+# File layout: header, then records of (type, payload length, payload)
+MAGIC: bytes = b'HREC'
+VERSION: int = 3
+HEADER: struct.Struct = struct.Struct('>4sBI')
+RECORD: struct.Struct = struct.Struct('>BI')
+
+# Record types
+TICK: int = 1
+PACKET: int = 2
+SNAPSHOT: int = 3
+
+# Payloads
+TICK_PAYLOAD: struct.Struct = struct.Struct('>i')
+SNAPSHOT_PAYLOAD: struct.Struct = struct.Struct('>QQ')
+
+
+class Recorder():
+    """Records a simulation run to an append-only file.
+
+    The house must be built with build_house from the config and seed given
+    here. Ticks and control packets have to go through the recorder, which
+    serializes them so the recorded order is the order they were applied in.
+    """
+
+    def __init__(
+            self,
+            path: str,
+            config: dict,
+            seed: Optional[int] = None,
+            snapshot_interval: int = 1440
+            ) -> None:
+        """Initialize the recorder and build the recorded house.
+
+        Args:
+            path (str): File to record to
+            config (dict): house_data, appliance_data and coefficients for build_house
+            seed (Optional[int]): Seed of the house, a fresh one is drawn if None
+            snapshot_interval (int): Ticks between snapshots
+
+        Returns:
+            None:
+        """
+
+        if seed is None:
+            seed = SeedSequence().entropy
+
+        self.seed: int = seed
+        self.house: House = build_house(
+                config['house_data'],
+                config['appliance_data'],
+                config['coefficients'],
+                seed
+                )
+        self._snapshot_interval: int = snapshot_interval
+        self._ticks: int = 0
+        self._lock: Lock = Lock()
+
+        meta = json.dumps({'config': config, 'seed': seed}).encode()
+        self._fd: BinaryIO = open(path, 'wb')
+        self._fd.write(HEADER.pack(MAGIC, VERSION, len(meta)) + meta)
+
+        self._snapshot()
+
+    def _write(self, record_type: int, payload: bytes) -> None:
+        self._fd.write(RECORD.pack(record_type, len(payload)) + payload)
+
+    def _snapshot(self) -> None:
+        self._write(
+                SNAPSHOT,
+                SNAPSHOT_PAYLOAD.pack(self._ticks, self.house.time) + \
+                        self.house.snapshot()
+                )
+        self._fd.flush()
+
+    def tick(self, delta_time: int) -> tuple[list[bool], float, float, int]:
+        """Advance the time and tick the house.
+
+        Args:
+            delta_time (int): Change in seconds before the tick
+
+        Returns:
+            tuple[list[bool], float, float, int]: Output of House.tick
+        """
+
+        with self._lock:
+            self._write(TICK, TICK_PAYLOAD.pack(delta_time))
+            self.house.update_time(delta_time)
+            result = self.house.tick()
+            self._ticks += 1
+
+            if self._ticks % self._snapshot_interval == 0:
+                self._snapshot()
+
+        return result
+
+    def packet(self, packet: bytes) -> tuple[int, int, dict, int]:
+        """Decompile and apply a control packet.
+
+        Args:
+            packet (bytes): The raw control packet
+
+        Returns:
+            tuple[int, int, dict, int]: The decompiled packet
+        """
+
+        with self._lock:
+            self._write(PACKET, packet)
+            decompiled = decompile_packet(packet)
+            apply_controlpacket(self.house, decompiled)
+
+        return decompiled
+
+    def close(self) -> None:
+        """Flush and close the recording."""
+
+        with self._lock:
+            self._fd.close()
+
+
+class Replayer():
+    """Rebuilds the house of a recording at any tick.
+
+    Seeking restores the closest snapshot before the target and fast-forwards
+    the recorded ticks and packets from there.
+    """
+
+    def __init__(self, path: str) -> None:
+        """Open and index a recording.
+
+        Args:
+            path (str): The recorded file
+
+        Returns:
+            None:
+        """
+
+        with open(path, 'rb') as fd:
+            self._buf = mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, metasize = HEADER.unpack_from(self._buf, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError('Not a recording or unsupported version')
+
+        meta = json.loads(self._buf[HEADER.size:HEADER.size+metasize])
+        self.config: dict = meta['config']
+        self.seed: int = meta['seed']
+
+        # Index the records: (type, payload start, payload end)
+        self._records: list[tuple[int, int, int]] = []
+
+        # Snapshots: (tick, time, record index)
+        self._snapshots: list[tuple[int, int, int]] = []
+
+        cursor = HEADER.size + metasize
+        ticks = 0
+        while cursor + RECORD.size <= len(self._buf):
+            record_type, size = RECORD.unpack_from(self._buf, cursor)
+            start = cursor + RECORD.size
+
+            # Stop at a record cut off by a crash
+            if start + size > len(self._buf):
+                break
+
+            if record_type == TICK:
+                ticks += 1
+            elif record_type == SNAPSHOT:
+                tick, time = SNAPSHOT_PAYLOAD.unpack_from(self._buf, start)
+                self._snapshots.append((tick, time, len(self._records)))
+
+            self._records.append((record_type, start, start + size))
+            cursor = start + size
+
+        self.ticks: int = ticks
+
+        # Snapshots only hold the state, forks of this house hold the config
+        self._house: House = build_house(
+                self.config['house_data'],
+                self.config['appliance_data'],
+                self.config['coefficients'],
+                self.seed
+                )
+
+    def _restore(self, snapshot: int) -> House:
+        _, start, _ = self._records[self._snapshots[snapshot][2]]
+        house = self._house.fork()
+        house.restore(self._buf, start + SNAPSHOT_PAYLOAD.size)
+        return house
+
+    def _fast_forward(
+            self,
+            house: House,
+            snapshot: int,
+            tick: Optional[int] = None,
+            time: Optional[int] = None
+            ) -> House:
+        ticks, _, index = self._snapshots[snapshot]
+
+        for record_type, start, end in self._records[index+1:]:
+            if (tick is not None and ticks >= tick) or \
+                    (time is not None and house.time >= time):
+                break
+
+            if record_type == TICK:
+                house.update_time(TICK_PAYLOAD.unpack_from(self._buf, start)[0])
+                house.tick()
+                ticks += 1
+
+            elif record_type == PACKET:
+                apply_controlpacket(house, decompile_packet(self._buf[start:end]))
+
+        return house
+
+    def seek(self, tick: int) -> House:
+        """Rebuild the house right after the given number of ticks.
+
+        Args:
+            tick (int): Ticks since the start of the recording
+
+        Returns:
+            House: The house at that tick
+        """
+
+        snapshot = max(
+                i for i, (snapshot_tick, _, _) in enumerate(self._snapshots)
+                if snapshot_tick <= tick
+                )
+
+        return self._fast_forward(self._restore(snapshot), snapshot, tick=tick)
+
+    def seek_time(self, time: int) -> House:
+        """Rebuild the house at the first tick reaching the given time.
+
+        Args:
+            time (int): Simulated unix time
+
+        Returns:
+            House: The house at that time
+        """
+
+        snapshot = max(
+                [i for i, (_, snapshot_time, _) in enumerate(self._snapshots)
+                 if snapshot_time <= time] or [0]
+                )
+
+        return self._fast_forward(self._restore(snapshot), snapshot, time=time)
+
+    def close(self) -> None:
+        """Close the recording."""
+
+        self._buf.close()
@@ -0,0 +1,391 @@
+# supervisor.py
+
+# Import Modules
+from typing import Optional
+from multiprocessing import Process, Pipe, Event
+from multiprocessing.connection import Connection
+from collections import deque
+from time import sleep, perf_counter
+import selectors
+import argparse
+import socket
+import json
+import os
+
+# Own modules
+from communication_utils import batch_datatrans_packetinator, decompile_packet, \
+        DeltaTelemetryEncoder, batch_delta_packetinator
+from house_utils import build_house, devices_bitmask, apply_controlpacket
+
+
+# GLOBAL VARS
+SIGNALPORT: int = 6969
+CONTROLPROTOCOLPORT: int = 42069
+TELEMETRYPORT: int = 42071
+
+# Houses per telemetry datagram (17 bytes each, stays below the MTU)
+BATCHSIZE: int = 64
+
+# Control connections carry a house id then the control packet
+HOUSEIDSIZE: int = 4
+MAXCONTROLSIZE: int = HOUSEIDSIZE + 1024
+
+# Control packets waiting per worker pipe, newer ones are dropped beyond this
+MAXQUEUED: int = 4096
+
+
+def run_shard(
+        shard: int,
+        house_datas: dict[int, dict],
+        appliance_data: dict,
+        coefficients: dict,
+        commands: Connection,
+        started,
+        stopped,
+        data_target: tuple[str, int],
+        tick_interval: float,
+        time_step: int,
+        seed: Optional[int],
+        delta: bool = False
+        ) -> None:
+    """Tick loop of a worker process owning a shard of the houses.
+
+    Control packets routed by the supervisor are applied between ticks,
+    the telemetry of the shard is sent in batches from the shared port.
+    Acknowledgements cannot be routed back to the worker of a house, so
+    change-only telemetry relies on the periodic keyframes.
+
+    Args:
+        shard (int): Number of the shard, also the core it is pinned to
+        house_datas (dict[int, dict]): Settings by house id
+        appliance_data (dict): The content of appliance_data.json
+        coefficients (dict): The content of coefficients.json
+        commands (Connection): Receiving end of the control channel
+        started (Event): Set when the start signal is received
+        stopped (Event): Set when the stop signal is received
+        data_target (tuple[str, int]): Where to send the telemetry
+        tick_interval (float): Real seconds between ticks
+        time_step (int): Simulated seconds per tick
+        seed (Optional[int]): Base seed, house ids are added to it
+        delta (bool): Send change-only telemetry
+
+    Returns:
+        None:
+    """
+
+    # Pin the worker to its own core
+    if hasattr(os, 'sched_setaffinity'):
+        cores = sorted(os.sched_getaffinity(0))
+        os.sched_setaffinity(0, {cores[shard % len(cores)]})
+
+    houses = {
+            house_id: build_house(
+                house_data,
+                appliance_data,
+                coefficients,
+                None if seed is None else seed + house_id
+                )
+            for house_id, house_data in house_datas.items()
+            }
+
+    encoders = {
+            house_id: DeltaTelemetryEncoder(acknowledged=False) for house_id in houses
+            } if delta else None
+
+    # Every worker sends from the same port
+    datasock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    if hasattr(socket, 'SO_REUSEPORT'):
+        datasock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    datasock.bind(('', TELEMETRYPORT))
+
+    started.wait()
+    next_tick = perf_counter()
+
+    while not stopped.is_set():
+        next_tick += tick_interval
+        delay = next_tick - perf_counter()
+        if delay > 0:
+            sleep(delay)
+
+        # Apply the routed control packets between ticks
+        while commands.poll():
+            message = commands.recv_bytes()
+            house_id = int.from_bytes(message[:4], 'big')
+            try:
+                apply_controlpacket(houses[house_id], decompile_packet(message[4:]))
+            except Exception as e:
+                print(e)
+
+        records = []
+        for house_id, house in houses.items():
+            house.update_time(time_step)
+            devicelist, powerusage, temperature, time = house.tick()
+
+            if encoders is None:
+                records.append((house_id, devices_bitmask(devicelist), powerusage, temperature, time))
+                continue
+
+            packet = encoders[house_id].encode(devices_bitmask(devicelist), powerusage, temperature, time)
+            if packet is not None:
+                records.append((house_id, packet))
+
+        packetinator = batch_datatrans_packetinator if encoders is None else batch_delta_packetinator
+        for start in range(0, len(records), BATCHSIZE):
+            datasock.sendto(packetinator(records[start:start+BATCHSIZE]), data_target)
+
+    datasock.close()
+
+
+class Supervisor():
+    """Shards houses across worker processes and routes control packets.
+
+    All houses share one control port, every connection starts with the
+    4 byte house id followed by the control packet. The supervisor reads
+    the connections without blocking and forwards each packet over a pipe
+    to the worker owning the house.
+    """
+
+    def __init__(
+            self,
+            house_datas: list[dict],
+            appliance_data: dict,
+            coefficients: dict,
+            workers: int = os.cpu_count() or 1,
+            data_target: tuple[str, int] = ('10.10.0.1', 42070),
+            control_port: int = CONTROLPROTOCOLPORT,
+            tick_interval: float = 1.0,
+            time_step: int = 60,
+            seed: Optional[int] = None,
+            delta: bool = False
+            ) -> None:
+        """Initialize the supervisor and start the workers.
+
+        Args:
+            house_datas (list[dict]): Settings per house, the index is the house id
+            appliance_data (dict): The content of appliance_data.json
+            coefficients (dict): The content of coefficients.json
+            workers (int): Number of worker processes
+            data_target (tuple[str, int]): Where the workers send the telemetry
+            control_port (int): Control port shared by all houses
+            tick_interval (float): Real seconds between ticks
+            time_step (int): Simulated seconds per tick
+            seed (Optional[int]): Base seed, house ids are added to it
+            delta (bool): Send change-only telemetry
+
+        Returns:
+            None:
+        """
+
+        workers = max(1, min(workers, len(house_datas)))
+        self._started = Event()
+        self._stopped = Event()
+
+        # House id to the sending end of the owning worker
+        self._routes: dict[int, Connection] = {}
+
+        # Packets waiting until the pipe of the worker can take them
+        self._queues: dict[Connection, deque[bytes]] = {}
+        self._workers: list[Process] = []
+
+        for shard in range(workers):
+            receiver, sender = Pipe(duplex=False)
+            shard_houses = {
+                    house_id: house_datas[house_id]
+                    for house_id in range(shard, len(house_datas), workers)
+                    }
+
+            for house_id in shard_houses:
+                self._routes[house_id] = sender
+
+            worker = Process(
+                    target=run_shard,
+                    args=(
+                        shard,
+                        shard_houses,
+                        appliance_data,
+                        coefficients,
+                        receiver,
+                        self._started,
+                        self._stopped,
+                        data_target,
+                        tick_interval,
+                        time_step,
+                        seed,
+                        delta
+                        ),
+                    daemon=True
+                    )
+            worker.start()
+            self._workers.append(worker)
+
+        self._selector = selectors.DefaultSelector()
+
+        self._controlsock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._controlsock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._controlsock.bind(('', control_port))
+        self._controlsock.listen(socket.SOMAXCONN)
+        self._controlsock.setblocking(False)
+        self._selector.register(self._controlsock, selectors.EVENT_READ, None)
+
+        self._signalsock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._signalsock.bind(('', SIGNALPORT))
+        self._selector.register(self._signalsock, selectors.EVENT_READ, None)
+
+    def route(self, house_id: int, packet: bytes) -> None:
+        """Forward a control packet to the worker owning the house.
+
+        Args:
+            house_id (int): The house
+            packet (bytes): The raw control packet
+
+        Returns:
+            None:
+        """
+
+        sender = self._routes[house_id]
+        queue = self._queues.setdefault(sender, deque())
+        if len(queue) >= MAXQUEUED:
+            return
+
+        # Workers drain their pipe once per tick, so only write when the
+        # selector reports room and never block the serving loop
+        if not queue:
+            self._selector.register(sender, selectors.EVENT_WRITE, None)
+        queue.append(house_id.to_bytes(HOUSEIDSIZE, 'big') + packet)
+
+    def _flush(self, sender: Connection) -> None:
+        """Write a queued packet to a worker pipe that has room.
+
+        The packets are below PIPE_BUF, so one write to a writable pipe
+        does not block.
+
+        Args:
+            sender (Connection): Sending end of the worker pipe
+
+        Returns:
+            None:
+        """
+
+        queue = self._queues[sender]
+        sender.send_bytes(queue.popleft())
+        if not queue:
+            self._selector.unregister(sender)
+
+    def _accept(self) -> None:
+        """Accept the pending control connections without blocking."""
+
+        while True:
+            try:
+                csock, _ = self._controlsock.accept()
+            except BlockingIOError:
+                return
+
+            csock.setblocking(False)
+            self._selector.register(csock, selectors.EVENT_READ, bytearray())
+
+    def _read(self, csock: socket.socket, buffer: bytearray) -> None:
+        """Read from a control connection, route its packet once it closes.
+
+        Args:
+            csock (socket.socket): The control connection
+            buffer (bytearray): What was received on it so far
+
+        Returns:
+            None:
+        """
+
+        try:
+            d = csock.recv(MAXCONTROLSIZE)
+        except BlockingIOError:
+            return
+        except OSError:
+            d = b''
+            buffer.clear()
+
+        if d and len(buffer) + len(d) <= MAXCONTROLSIZE:
+            buffer += d
+            return
+
+        # Closed by the sender, or too long to be a control packet
+        self._selector.unregister(csock)
+        csock.close()
+
+        if d or len(buffer) <= HOUSEIDSIZE:
+            return
+
+        house_id = int.from_bytes(buffer[:HOUSEIDSIZE], 'big')
+        if house_id in self._routes:
+            self.route(house_id, bytes(buffer[HOUSEIDSIZE:]))
+
+    def serve(self) -> None:
+        """Route control packets and signals until the stop signal."""
+
+        while not self._stopped.is_set():
+            for key, _ in self._selector.select():
+                if key.fileobj is self._controlsock:
+                    self._accept()
+
+                elif key.fileobj in self._queues:
+                    self._flush(key.fileobj)
+
+                # Start/stop signal
+                elif key.fileobj is self._signalsock:
+                    d, _ = self._signalsock.recvfrom(128)
+                    if d[0] > 0:
+                        self._started.set()
+                    elif self._started.is_set():
+                        self._stopped.set()
+
+                else:
+                    self._read(key.fileobj, key.data)
+
+        self.close()
+
+    def close(self) -> None:
+        """Stop the workers and close the sockets."""
+
+        self._started.set()
+        self._stopped.set()
+        for worker in self._workers:
+            worker.join()
+
+        for key in list(self._selector.get_map().values()):
+            key.fileobj.close()
+        self._selector.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Run the houses of house_settings.json sharded across worker processes")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--copies', type=int, default=1, help="Houses to run per entry in house_settings.json")
+    parser.add_argument('--data-target', default='10.10.0.1:42070')
+    parser.add_argument('--control-port', type=int, default=CONTROLPROTOCOLPORT, help="Control port shared by all houses")
+    parser.add_argument('--tick-interval', type=float, default=1.0)
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--delta', action='store_true', help="Send change-only telemetry")
+    args = parser.parse_args()
+
+    with open('coefficients.json', 'r') as fd:
+        coefficients = json.load(fd)
+
+    with open('house_settings.json', 'r') as fd:
+        house_setting = json.load(fd)
+
+    with open('appliance_data.json', 'r') as fd:
+        appliance_data = json.load(fd)
+
+    ip, port = args.data_target.rsplit(':', 1)
+    supervisor = Supervisor(
+            [house_data for house_data in house_setting.values() for _ in range(args.copies)],
+            appliance_data,
+            coefficients,
+            args.workers,
+            (ip, int(port)),
+            args.control_port,
+            args.tick_interval,
+            seed=args.seed,
+            delta=args.delta
+            )
+
+    print("Ready for Area Controller")
+    supervisor.serve()
@@ -0,0 +1,313 @@
+# timeseries_export.py
+
+# Import Modules
+from typing import Self, Optional, Iterator
+from struct import Struct
+import os
+
+import numpy as np
+
+
+# Columns of the tick results
+COLUMNS: dict[str, type] = {
+        'time': np.int64,
+        'house': np.int32,
+        'devices': np.uint8,
+        'power': np.float32,
+        'temperature': np.float32
+        }
+
+# Index record: chunk number, rows, first time, last time, compressed
+INDEX_RECORD: Struct = Struct('>IIqq?')
+INDEX_FILE: str = 'index.bin'
+
+
+def _chunk_path(path: str, chunk: int, compressed: bool) -> str:
+    return os.path.join(path, f'chunk_{chunk:08d}.' + ('npz' if compressed else 'bin'))
+
+
+class TimeseriesWriter():
+    """Writes tick results to a directory of fixed size columnar chunks.
+
+    Rows are buffered until a chunk is full, then the chunk is written and a
+    record is appended to the index. Compressed chunks are npz files,
+    uncompressed chunks are the raw columns one after another so they can be
+    memory mapped. Opening an existing directory appends to it.
+    """
+
+    def __init__(
+            self: Self,
+            path: str,
+            chunk_size: int = 65536,
+            compress: bool = True
+            ) -> None:
+        """Initialize the writer.
+
+        Args:
+            self (Self): self
+            path (str): Directory to write to
+            chunk_size (int): Rows per chunk
+            compress (bool): Compress the chunks
+
+        Returns:
+            None:
+        """
+
+        os.makedirs(path, exist_ok=True)
+
+        self._path: str = path
+        self._chunk_size: int = chunk_size
+        self._compress: bool = compress
+
+        # Continue after the chunks already in the index
+        index_path = os.path.join(path, INDEX_FILE)
+        self._chunk: int = os.path.getsize(index_path) // INDEX_RECORD.size \
+                if os.path.exists(index_path) else 0
+        self._index = open(index_path, 'ab')
+
+        self._buffer: dict[str, np.ndarray] = {
+                name: np.empty(chunk_size, dtype=dtype) for name, dtype in COLUMNS.items()
+                }
+        self._rows: int = 0
+
+    def append(
+            self: Self,
+            time: int,
+            house: int,
+            devices: int,
+            power: float,
+            temperature: float
+            ) -> None:
+        """Append the result of one tick.
+
+        Args:
+            self (Self): self
+            time (int): Unix time
+            house (int): House id
+            devices (int): Device bitmask
+            power (float): kW draw
+            temperature (float): Temperature
+
+        Returns:
+            None:
+        """
+
+        row = self._rows
+        self._buffer['time'][row] = time
+        self._buffer['house'][row] = house
+        self._buffer['devices'][row] = devices
+        self._buffer['power'][row] = power
+        self._buffer['temperature'][row] = temperature
+        self._rows += 1
+
+        if self._rows == self._chunk_size:
+            self.flush()
+
+    def extend(self: Self, **columns: np.ndarray) -> None:
+        """Append many results at once, given as equally long columns.
+
+        Args:
+            self (Self): self
+            **columns (np.ndarray): One array per column in COLUMNS (house may be a scalar)
+
+        Returns:
+            None:
+        """
+
+        length = len(columns['time'])
+        columns = {
+                name: np.broadcast_to(columns[name], length) for name in COLUMNS
+                }
+
+        done = 0
+        while done < length:
+            take = min(length - done, self._chunk_size - self._rows)
+            for name in COLUMNS:
+                self._buffer[name][self._rows:self._rows+take] = columns[name][done:done+take]
+            self._rows += take
+            done += take
+
+            if self._rows == self._chunk_size:
+                self.flush()
+
+    def flush(self: Self) -> None:
+        """Write the buffered rows as a chunk, even if it is not full.
+
+        Args:
+            self (Self): self
+
+        Returns:
+            None:
+        """
+
+        if self._rows == 0:
+            return
+
+        columns = {name: column[:self._rows] for name, column in self._buffer.items()}
+        chunk_path = _chunk_path(self._path, self._chunk, self._compress)
+
+        if self._compress:
+            np.savez_compressed(chunk_path, **columns)
+        else:
+            with open(chunk_path, 'wb') as fd:
+                for name in COLUMNS:
+                    fd.write(columns[name].tobytes())
+
+        self._index.write(INDEX_RECORD.pack(
+            self._chunk,
+            self._rows,
+            columns['time'].min(),
+            columns['time'].max(),
+            self._compress
+            ))
+        self._index.flush()
+
+        self._chunk += 1
+        self._rows = 0
+
+    def close(self: Self) -> None:
+        """Write the last chunk and close the index.
+
+        Args:
+            self (Self): self
+
+        Returns:
+            None:
+        """
+
+        self.flush()
+        self._index.close()
+
+    def __enter__(self: Self) -> Self:
+        return self
+
+    def __exit__(self: Self, *_) -> None:
+        self.close()
+
+
+class TimeseriesReader():
+    """Reads time ranges from a directory written by TimeseriesWriter.
+
+    Only the chunks overlapping the requested range are opened, uncompressed
+    chunks are memory mapped.
+    """
+
+    def __init__(self: Self, path: str) -> None:
+        """Open the directory and load the index.
+
+        Args:
+            self (Self): self
+            path (str): Directory written by TimeseriesWriter
+
+        Returns:
+            None:
+        """
+
+        self._path: str = path
+
+        with open(os.path.join(path, INDEX_FILE), 'rb') as fd:
+            data = fd.read()
+
+        # Ignore a record cut off by a crash
+        records = list(INDEX_RECORD.iter_unpack(
+            data[:len(data) - len(data) % INDEX_RECORD.size]
+            ))
+
+        self._chunks: np.ndarray = np.array([record[0] for record in records], dtype=np.int64)
+        self._rows: np.ndarray = np.array([record[1] for record in records], dtype=np.int64)
+        self._t_min: np.ndarray = np.array([record[2] for record in records], dtype=np.int64)
+        self._t_max: np.ndarray = np.array([record[3] for record in records], dtype=np.int64)
+        self._compressed: np.ndarray = np.array([record[4] for record in records], dtype=bool)
+
+    @property
+    def rows(self: Self) -> int:
+        """Total number of rows."""
+
+        return int(self._rows.sum())
+
+    def _load(self: Self, i: int) -> dict[str, np.ndarray]:
+        chunk_path = _chunk_path(self._path, self._chunks[i], self._compressed[i])
+
+        if self._compressed[i]:
+            with np.load(chunk_path) as npz:
+                return {name: npz[name] for name in COLUMNS}
+
+        columns = {}
+        offset = 0
+        for name, dtype in COLUMNS.items():
+            columns[name] = np.memmap(
+                    chunk_path,
+                    dtype=dtype,
+                    mode='r',
+                    offset=offset,
+                    shape=(self._rows[i],)
+                    )
+            offset += self._rows[i] * np.dtype(dtype).itemsize
+
+        return columns
+
+    def chunks(
+            self: Self,
+            start: Optional[int] = None,
+            end: Optional[int] = None,
+            house: Optional[int] = None
+            ) -> Iterator[dict[str, np.ndarray]]:
+        """Iterate over the rows in a time range, one chunk at a time.
+
+        Args:
+            self (Self): self
+            start (Optional[int]): First time to include
+            end (Optional[int]): Time to stop before
+            house (Optional[int]): Only rows of this house
+
+        Returns:
+            Iterator[dict[str, np.ndarray]]: Columns of the matching rows per chunk
+        """
+
+        overlapping = np.ones(len(self._chunks), dtype=bool)
+        if start is not None:
+            overlapping &= self._t_max >= start
+        if end is not None:
+            overlapping &= self._t_min < end
+
+        for i in np.flatnonzero(overlapping):
+            columns = self._load(i)
+
+            mask = np.ones(self._rows[i], dtype=bool)
+            if start is not None:
+                mask &= columns['time'] >= start
+            if end is not None:
+                mask &= columns['time'] < end
+            if house is not None:
+                mask &= columns['house'] == house
+
+            if mask.all():
+                yield columns
+            elif mask.any():
+                yield {name: column[mask] for name, column in columns.items()}
+
+    def read(
+            self: Self,
+            start: Optional[int] = None,
+            end: Optional[int] = None,
+            house: Optional[int] = None
+            ) -> dict[str, np.ndarray]:
+        """Read the rows in a time range.
+
+        Args:
+            self (Self): self
+            start (Optional[int]): First time to include
+            end (Optional[int]): Time to stop before
+            house (Optional[int]): Only rows of this house
+
+        Returns:
+            dict[str, np.ndarray]: Columns of the matching rows
+        """
+
+        parts = list(self.chunks(start, end, house))
+        if not parts:
+            return {name: np.empty(0, dtype=dtype) for name, dtype in COLUMNS.items()}
+
+        return {
+                name: np.concatenate([part[name] for part in parts]) for name in COLUMNS
+                }